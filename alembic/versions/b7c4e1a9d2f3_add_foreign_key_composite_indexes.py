@@ -0,0 +1,40 @@
+"""add composite indexes on foreign key filter paths
+
+Revision ID: b7c4e1a9d2f3
+Revises: 62e832763a1f
+Create Date: 2026-10-16 10:12:41.508213
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7c4e1a9d2f3'
+down_revision: Union[str, None] = '62e832763a1f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_identities_user_id_id', 'identities', ['user_id', 'id'], unique=False)
+    op.create_index('ix_skills_identity_id_id', 'skills', ['identity_id', 'id'], unique=False)
+    op.create_index('ix_habits_user_id_streak', 'habits', ['user_id', 'streak'], unique=False)
+    op.create_index('ix_habits_skill_id', 'habits', ['skill_id'], unique=False)
+    op.create_index('ix_tasks_user_id_completed_id', 'tasks', ['user_id', 'completed', 'id'], unique=False)
+    op.create_index('ix_tasks_skill_id', 'tasks', ['skill_id'], unique=False)
+    op.create_index('ix_tasks_identity_id', 'tasks', ['identity_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_tasks_identity_id', table_name='tasks')
+    op.drop_index('ix_tasks_skill_id', table_name='tasks')
+    op.drop_index('ix_tasks_user_id_completed_id', table_name='tasks')
+    op.drop_index('ix_habits_skill_id', table_name='habits')
+    op.drop_index('ix_habits_user_id_streak', table_name='habits')
+    op.drop_index('ix_skills_identity_id_id', table_name='skills')
+    op.drop_index('ix_identities_user_id_id', table_name='identities')
@@ -0,0 +1,44 @@
+"""add habit completions and streak status
+
+Revision ID: d5a1c7e9f0b2
+Revises: c3e8f2a6b1d4
+Create Date: 2026-10-16 16:41:09.402715
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a1c7e9f0b2'
+down_revision: Union[str, None] = 'c3e8f2a6b1d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('habit_completions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('habit_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('completed_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['habit_id'], ['habits.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_habit_completions_id'), 'habit_completions', ['id'], unique=False)
+    op.create_index('ix_habit_completions_habit_id_completed_at', 'habit_completions', ['habit_id', 'completed_at'], unique=False)
+    op.add_column('habits', sa.Column('streak_status', sa.String(length=16), server_default='due', nullable=False))
+    op.create_index('ix_habits_user_id_streak_status', 'habits', ['user_id', 'streak_status'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_habits_user_id_streak_status', table_name='habits')
+    op.drop_column('habits', 'streak_status')
+    op.drop_index('ix_habit_completions_habit_id_completed_at', table_name='habit_completions')
+    op.drop_index(op.f('ix_habit_completions_id'), table_name='habit_completions')
+    op.drop_table('habit_completions')
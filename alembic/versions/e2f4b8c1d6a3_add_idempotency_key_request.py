@@ -0,0 +1,32 @@
+"""add idempotency key request
+
+Revision ID: e2f4b8c1d6a3
+Revises: d5a1c7e9f0b2
+Create Date: 2026-10-17 09:12:44.205318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2f4b8c1d6a3'
+down_revision: Union[str, None] = 'd5a1c7e9f0b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('idempotency_keys', sa.Column('method', sa.String(length=10), nullable=True))
+    op.add_column('idempotency_keys', sa.Column('path', sa.String(length=255), nullable=True))
+    op.add_column('idempotency_keys', sa.Column('body_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('idempotency_keys', 'body_hash')
+    op.drop_column('idempotency_keys', 'path')
+    op.drop_column('idempotency_keys', 'method')
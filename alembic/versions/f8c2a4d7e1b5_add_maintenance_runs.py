@@ -0,0 +1,32 @@
+"""add maintenance runs
+
+Revision ID: f8c2a4d7e1b5
+Revises: e2f4b8c1d6a3
+Create Date: 2026-10-17 11:36:05.817264
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f8c2a4d7e1b5'
+down_revision: Union[str, None] = 'e2f4b8c1d6a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('maintenance_runs',
+    sa.Column('job', sa.String(length=64), nullable=False),
+    sa.Column('run_on', sa.Date(), nullable=False),
+    sa.PrimaryKeyConstraint('job')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('maintenance_runs')
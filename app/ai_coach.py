@@ -1,8 +1,53 @@
-from sqlalchemy.orm import Session
-from . import models
+import asyncio
+import hashlib
+import json
+import re
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+import httpx
+from openai import AsyncOpenAI
+from sqlalchemy import literal, null, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, metrics
+from .cache import TTLCache
+from .config import settings
 
+COACH_MODEL = "gpt-4o"
 
-def get_user_context(db: Session, user: models.User, identity_id: int = None, skill_id: int = None):
+# One AsyncOpenAI client per process, created at startup, so every coach
+# request reuses pooled HTTP connections. The SDK retries 429/5xx/timeouts
+# with exponential backoff plus jitter; the semaphore caps in-flight calls.
+_client: Optional[AsyncOpenAI] = None
+_call_slots: Optional[asyncio.Semaphore] = None
+
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English prose; good enough for budgeting
+    return len(text) // 4 + 1
+
+
+def _fit_token_budget(tasks: list, habits: list, budget: int):
+    """Drop the least relevant items until the context fits the token budget"""
+    limit = settings.COACH_CONTEXT_MAX_TITLE_CHARS
+    tasks = [title[:limit] for title in tasks]
+    habits = [{**h, "name": h["name"][:limit]} for h in habits]
+
+    used = sum(_estimate_tokens(t) for t in tasks) + sum(_estimate_tokens(h["name"]) + 4 for h in habits)
+    while used > budget and (tasks or habits):
+        # Trim whichever list is longer, from its least relevant end
+        if len(tasks) >= len(habits):
+            used -= _estimate_tokens(tasks.pop())
+        else:
+            used -= _estimate_tokens(habits.pop()["name"]) + 4
+    return tasks, habits
+
+
+async def get_user_context(db: AsyncSession, user: models.User, identity_id: int = None, skill_id: int = None):
+    """Prompt context: the most recent pending tasks and the habits with the longest streaks.
+
+    Both lists are bounded, fetched in a single UNION ALL round trip reading
+    only the columns the prompt needs, and trimmed to a token budget.
+    """
     context = {
         "user_level": user.level,
         "user_exp": user.exp,
@@ -11,63 +56,341 @@ def get_user_context(db: Session, user: models.User, identity_id: int = None, sk
         "recent_habits": [],
     }
 
-    # Get pending tasks
-    query = db.query(models.Task).filter(
+    # Most recent pending tasks
+    tasks = select(
+        literal("task").label("kind"),
+        models.Task.title.label("label"),
+        literal(0).label("streak"),
+        null().label("status"),
+        models.Task.id.label("rank"),
+    ).where(
         models.Task.user_id == user.id,
         models.Task.completed == False
     )
     if identity_id:
-        query = query.filter(models.Task.identity_id == identity_id)
+        tasks = tasks.where(models.Task.identity_id == identity_id)
     if skill_id:
-        query = query.filter(models.Task.skill_id == skill_id)
-    context["pending_tasks"] = [task.title for task in query.all()]
+        tasks = tasks.where(models.Task.skill_id == skill_id)
+    tasks = tasks.order_by(models.Task.id.desc()).limit(settings.COACH_CONTEXT_MAX_TASKS).subquery()
 
-    # Get recent habits and their streaks
-    query = db.query(models.Habit).filter(models.Habit.user_id == user.id)
+    # Habits with the longest streaks
+    habits = select(
+        literal("habit").label("kind"),
+        models.Habit.name.label("label"),
+        models.Habit.streak.label("streak"),
+        models.Habit.streak_status.label("status"),
+        models.Habit.id.label("rank"),
+    ).where(models.Habit.user_id == user.id)
     if skill_id:
-        query = query.filter(models.Habit.skill_id == skill_id)
-    habits = query.all()
-    context["recent_habits"] = [
-        {"name": habit.name, "streak": habit.streak}
-        for habit in habits
-    ]
+        habits = habits.where(models.Habit.skill_id == skill_id)
+    habits = habits.order_by(models.Habit.streak.desc(), models.Habit.id.desc()).limit(settings.COACH_CONTEXT_MAX_HABITS).subquery()
+
+    rows = (await db.execute(union_all(select(tasks), select(habits)))).all()
+
+    # UNION ALL does not guarantee order across branches, so re-sort per kind
+    task_rows = sorted((r for r in rows if r.kind == "task"), key=lambda r: r.rank, reverse=True)
+    habit_rows = sorted((r for r in rows if r.kind == "habit"), key=lambda r: (r.streak or 0, r.rank), reverse=True)
+    context["pending_tasks"], context["recent_habits"] = _fit_token_budget(
+        [r.label or "" for r in task_rows],
+        [{"name": r.label or "", "streak": r.streak or 0, "at_risk": r.status == "at_risk"} for r in habit_rows],
+        settings.COACH_CONTEXT_TOKEN_BUDGET,
+    )
 
     return context
 
 
-def get_ai_coach_response(user_input: str, persona: str, context: dict) -> str:
-    import os
-    from openai import OpenAI
+def _stub_usage(body: dict, content: str) -> dict:
+    prompt = sum(_estimate_tokens(m.get("content") or "") for m in body.get("messages", []))
+    completion = _estimate_tokens(content)
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def _stub_stream(body: dict, content: str) -> bytes:
+    events = []
+    words = content.split(" ")
+    for i, word in enumerate(words):
+        events.append({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", COACH_MODEL),
+            "choices": [{
+                "index": 0,
+                "delta": {"content": word if i == len(words) - 1 else word + " "},
+                "finish_reason": "stop" if i == len(words) - 1 else None,
+            }],
+        })
+    if (body.get("stream_options") or {}).get("include_usage"):
+        events.append({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", COACH_MODEL),
+            "choices": [],
+            "usage": _stub_usage(body, content),
+        })
+    lines = [f"data: {json.dumps(event)}\n\n" for event in events]
+    lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode()
+
+
+def _stub_handler(request: httpx.Request) -> httpx.Response:
+    """Canned chat completion so tests and benchmarks run without network access"""
+    body = json.loads(request.content or b"{}")
+    user_input = body.get("messages", [{}])[-1].get("content", "")
+    if body.get("stream"):
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            content=_stub_stream(body, f"[stub coach] {user_input}"),
+        )
+    return httpx.Response(200, json={
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", COACH_MODEL),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": f"[stub coach] {user_input}"},
+            "finish_reason": "stop",
+        }],
+        "usage": _stub_usage(body, f"[stub coach] {user_input}"),
+    })
 
-    api_key = os.getenv("OPENAI_API_KEY")
-    print("🔑 Using API Key:", api_key[:10])  # DEBUGGING LINE
 
-    if not api_key or "sk-" not in api_key:
+def stub_transport() -> httpx.AsyncBaseTransport:
+    return httpx.MockTransport(_stub_handler)
+
+
+def init_openai_client(transport: Optional[httpx.AsyncBaseTransport] = None) -> AsyncOpenAI:
+    global _client, _call_slots
+
+    if transport is None and settings.OPENAI_STUB:
+        transport = stub_transport()
+
+    api_key = settings.OPENAI_API_KEY
+    if transport is None and (not api_key or "sk-" not in api_key):
         raise ValueError("❌ OPENAI_API_KEY not found or invalid in environment variables")
 
-    client = OpenAI(api_key=api_key)
+    http_client = httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(settings.OPENAI_TIMEOUT, connect=settings.OPENAI_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=settings.OPENAI_MAX_CONCURRENCY,
+            max_keepalive_connections=settings.OPENAI_MAX_CONCURRENCY,
+        ),
+    )
+    _client = AsyncOpenAI(
+        api_key=api_key or "stub",
+        max_retries=settings.OPENAI_MAX_RETRIES,
+        http_client=http_client,
+    )
+    _call_slots = asyncio.Semaphore(settings.OPENAI_MAX_CONCURRENCY)
+    # The SDK imports its resource modules on first attribute access; do that here, not in the first request
+    _client.chat.completions
+    return _client
+
+
+async def close_openai_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
 
-    prompt = f"""You are an AI coach with the following persona: {persona}
+
+def get_openai_client() -> AsyncOpenAI:
+    if _client is None:
+        return init_openai_client()
+    return _client
+
+
+def build_prompt(persona: str, context: dict, user_input: str) -> str:
+    return f"""You are an AI coach with the following persona: {persona}
 
 User Context:
 - Level: {context['user_level']}
 - Experience Points: {context['user_exp']}
 - Chrono Points: {context['chrono_points']}
 - Pending Tasks: {', '.join(context['pending_tasks']) if context['pending_tasks'] else 'None'}
-- Active Habits: {', '.join(f"{h['name']} (streak: {h['streak']})" for h in context['recent_habits']) if context['recent_habits'] else 'None'}
+- Active Habits: {', '.join(f"{h['name']} (streak: {h['streak']}{', not done yet today' if h.get('at_risk') else ''})" for h in context['recent_habits']) if context['recent_habits'] else 'None'}
 
 User Input: {user_input}
 
 Please provide motivational guidance and practical advice while staying in character as the specified persona."""
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": user_input}
-        ],
-        max_tokens=500,
-        temperature=0.7
+
+class MemoryResponseCache:
+    """In-process coach response cache (per worker)"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: str):
+        self._cache.set(key, value)
+
+
+class RedisResponseCache:
+    """Coach response cache shared by every worker through Redis (needs the `redis` package)"""
+
+    def __init__(self, url: str, ttl: float):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._ttl = int(ttl)
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self._redis.get(f"coach:{key}")
+        return value.decode() if value is not None else None
+
+    async def set(self, key: str, value: str):
+        await self._redis.set(f"coach:{key}", value, ex=self._ttl)
+
+
+def _build_response_cache():
+    if settings.COACH_CACHE_BACKEND == "redis":
+        return RedisResponseCache(settings.COACH_CACHE_REDIS_URL, settings.COACH_CACHE_TTL)
+    if settings.COACH_CACHE_BACKEND == "memory":
+        return MemoryResponseCache(settings.COACH_CACHE_SIZE, settings.COACH_CACHE_TTL)
+    return None
+
+
+# Any backend exposing async get(key) / set(key, value) can be assigned here
+response_cache = _build_response_cache()
+
+
+def _normalize_input(user_input: str) -> str:
+    return re.sub(r"\s+", " ", user_input).strip().casefold().rstrip(".!?")
+
+
+def response_cache_key(user_input: str, persona: str, context: dict) -> str:
+    """Fingerprint of everything that shapes the answer.
+
+    The context snapshot (pending tasks, habit streaks, exp) is part of the
+    key, so any change to the user's tasks or habits lands on a new entry and
+    stale answers simply age out.
+    """
+    payload = json.dumps(
+        {"model": COACH_MODEL, "persona": persona or "", "context": context, "input": _normalize_input(user_input)},
+        sort_keys=True,
+        separators=(",", ":"),
     )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def _cache_get(key: str) -> Optional[str]:
+    if response_cache is None:
+        return None
+    value = await response_cache.get(key)
+    if value is None:
+        metrics.COACH_CACHE_REQUESTS.labels("miss").inc()
+    else:
+        metrics.COACH_CACHE_REQUESTS.labels("hit").inc()
+    return value
+
+
+async def _cache_set(key: str, value: str):
+    if response_cache is not None and value:
+        await response_cache.set(key, value)
+
+
+def _coach_messages(user_input: str, persona: str, context: dict) -> list:
+    return [
+        {"role": "system", "content": build_prompt(persona, context, user_input)},
+        {"role": "user", "content": user_input}
+    ]
+
+
+def _record_openai_call(mode: str, outcome: str, seconds: float, usage=None):
+    metrics.OPENAI_REQUEST_DURATION.labels(COACH_MODEL, mode, outcome).observe(seconds)
+    if usage is not None:
+        metrics.OPENAI_TOKENS.labels(COACH_MODEL, "prompt").inc(usage.prompt_tokens or 0)
+        metrics.OPENAI_TOKENS.labels(COACH_MODEL, "completion").inc(usage.completion_tokens or 0)
+
+
+async def get_ai_coach_response(user_input: str, persona: str, context: dict) -> str:
+    cache_key = response_cache_key(user_input, persona, context)
+    cached = await _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    client = get_openai_client()
+
+    async with _call_slots:
+        start = time.perf_counter()
+        outcome = "error"
+        usage = None
+        try:
+            response = await client.chat.completions.create(
+                model=COACH_MODEL,
+                messages=_coach_messages(user_input, persona, context),
+                max_tokens=500,
+                temperature=0.7
+            )
+            outcome, usage = "ok", response.usage
+        finally:
+            _record_openai_call("complete", outcome, time.perf_counter() - start, usage)
+
+    content = response.choices[0].message.content
+    await _cache_set(cache_key, content)
+    return content
+
+
+async def stream_ai_coach_response(
+    user_input: str,
+    persona: str,
+    context: dict,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> AsyncIterator[str]:
+    """Yield completion text as it arrives; stops and closes the upstream stream once the client goes away"""
+    cache_key = response_cache_key(user_input, persona, context)
+    cached = await _cache_get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    client = get_openai_client()
+    parts = []
+    completed = False
+
+    async with _call_slots:
+        start = time.perf_counter()
+        outcome = "error"
+        usage = None
+        try:
+            stream = await client.chat.completions.create(
+                model=COACH_MODEL,
+                messages=_coach_messages(user_input, persona, context),
+                max_tokens=500,
+                temperature=0.7,
+                stream=True,
+                # Token counts arrive in one extra chunk at the end
+                stream_options={"include_usage": True},
+            )
+            try:
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    if is_disconnected is not None and await is_disconnected():
+                        outcome = "disconnected"
+                        break
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+                else:
+                    completed = True
+                    outcome = "ok"
+            except GeneratorExit:
+                # The response consumer went away mid-stream
+                outcome = "disconnected"
+                raise
+            finally:
+                await stream.close()
+        finally:
+            _record_openai_call("stream", outcome, time.perf_counter() - start, usage)
 
-    return response.choices[0].message.content
\ No newline at end of file
+    # Only complete answers are worth replaying
+    if completed:
+        await _cache_set(cache_key, "".join(parts))
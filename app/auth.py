@@ -1,24 +1,72 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from . import models
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, metrics
+from .cache import TTLCache
 from .schemas import auth_schemas
 from .database import get_db
 from .config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.PASSWORD_HASH_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop.
+# The semaphore bounds running + queued operations; callers wait at most
+# PASSWORD_HASH_QUEUE_TIMEOUT for a slot and get a 503 after that.
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_slots = asyncio.Semaphore(settings.PASSWORD_HASH_MAX_PENDING)
+
+# username -> Principal, so ownership-only requests skip the per-request user SELECT
+principal_cache = TTLCache(maxsize=settings.AUTH_PRINCIPAL_CACHE_SIZE, ttl=settings.AUTH_PRINCIPAL_CACHE_TTL)
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_principal(mapper, connection, target):
+    # Drop both the current and any previous username for the changed row
+    history = inspect(target).attrs.username.history
+    for username in {target.username, *history.deleted}:
+        principal_cache.pop(username)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+async def _run_password_op(operation: str, func, *args):
+    wait_start = time.perf_counter()
+    try:
+        await asyncio.wait_for(_hash_slots.acquire(), timeout=settings.PASSWORD_HASH_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        metrics.PASSWORD_HASH_REJECTED.labels(operation).inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        metrics.PASSWORD_HASH_QUEUE_WAIT.labels(operation).observe(time.perf_counter() - wait_start)
+        start = time.perf_counter()
+        result = await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+        metrics.PASSWORD_HASH_DURATION.labels(operation).observe(time.perf_counter() - start)
+        return result
+    finally:
+        _hash_slots.release()
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_password_op("verify", verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_password_op("hash", get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -29,27 +77,59 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm="HS256")
     return encoded_jwt
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> models.User:
-    credentials_exception = HTTPException(
+def token_claims(user: models.User) -> dict:
+    """Claims identifying `user` in a new access token"""
+    if settings.JWT_SUB_IS_USER_ID:
+        # The principal can be rebuilt from the token alone, without touching the database
+        return {"sub": str(user.id), "sub_type": "id", "username": user.username}
+    return {"sub": user.username}
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token(token: str) -> auth_schemas.TokenData:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = auth_schemas.TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
+        subject: str = payload.get("sub")
+        if subject is None:
+            raise _credentials_exception()
+        if payload.get("sub_type") == "id":
+            return auth_schemas.TokenData(username=payload.get("username"), user_id=int(subject))
+        return auth_schemas.TokenData(username=subject)
+    except (JWTError, ValueError):
+        raise _credentials_exception()
+
+async def get_current_principal(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db)
+) -> auth_schemas.Principal:
+    """Authenticated caller for endpoints that only need the user id for ownership checks"""
+    token_data = decode_token(token)
+    if token_data.user_id is not None:
+        return auth_schemas.Principal(id=token_data.user_id, username=token_data.username)
+
+    principal = principal_cache.get(token_data.username)
+    if principal is None:
+        row = (await db.execute(
+            select(models.User.id, models.User.username).where(models.User.username == token_data.username)
+        )).first()
+        if row is None:
+            raise _credentials_exception()
+        principal = auth_schemas.Principal(id=row.id, username=row.username)
+        principal_cache.set(token_data.username, principal)
+    return principal
+
+async def get_current_user(
+    principal: auth_schemas.Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
+) -> models.User:
+    user = await db.get(models.User, principal.id)
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     return user
 
 async def get_current_active_user(
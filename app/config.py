@@ -4,14 +4,77 @@ import os
 # Load variables from .env file
 load_dotenv()
 
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     # Get DATABASE_URL from environment or use SQLite as fallback
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./life_os.db")
     SECRET_KEY: str = os.getenv("SECRET_KEY")
-    OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY")
+    # Optional: without it the coach endpoints fail, everything else still serves
+    OPENAI_API_KEY: Optional[str] = None
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Issue tokens whose `sub` is the user id, so ownership checks need no user lookup at all
+    JWT_SUB_IS_USER_ID: bool = False
+    AUTH_PRINCIPAL_CACHE_SIZE: int = 10000
+    AUTH_PRINCIPAL_CACHE_TTL: int = 300
+    # bcrypt cost factor and the bounded pool that runs it
+    PASSWORD_HASH_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 16
+    PASSWORD_HASH_QUEUE_TIMEOUT: float = 5.0
+    # Shared AsyncOpenAI client used by the AI coach
+    OPENAI_TIMEOUT: float = 60.0
+    OPENAI_CONNECT_TIMEOUT: float = 5.0
+    OPENAI_MAX_RETRIES: int = 2
+    OPENAI_MAX_CONCURRENCY: int = 20
+    # Serve canned completions from a local transport instead of calling OpenAI
+    OPENAI_STUB: bool = False
+    # AI coach response cache: "memory" (per worker), "redis" (shared, needs the redis package) or "none"
+    COACH_CACHE_BACKEND: Literal["memory", "redis", "none"] = "memory"
+    COACH_CACHE_TTL: int = 3600
+    COACH_CACHE_SIZE: int = 2048
+    COACH_CACHE_REDIS_URL: str = "redis://localhost:6379/0"
+    # Bounds on the task/habit context sent with every coach prompt
+    COACH_CONTEXT_MAX_TASKS: int = 20
+    COACH_CONTEXT_MAX_HABITS: int = 10
+    COACH_CONTEXT_MAX_TITLE_CHARS: int = 120
+    COACH_CONTEXT_TOKEN_BUDGET: int = 400
+    # Level curve: reaching level L takes LEVEL_CURVE_BASE * (L - 1) ** LEVEL_CURVE_EXPONENT exp in total
+    LEVEL_CURVE_BASE: int = 100
+    LEVEL_CURVE_EXPONENT: float = 1.0
+    # Daily job resetting lapsed streaks and refreshing habit streak_status
+    STREAK_MAINTENANCE_ENABLED: bool = True
+    STREAK_MAINTENANCE_HOUR_UTC: int = 0
+    STREAK_MAINTENANCE_BATCH_SIZE: int = 5000
+    # Idempotency-Key records older than this are purged by the same job
+    IDEMPOTENCY_KEY_TTL_HOURS: int = 48
+    # How long browsers may cache a CORS preflight, and the share of preflights logged (0 = none)
+    CORS_MAX_AGE: int = 3600
+    CORS_LOG_SAMPLE_RATE: float = 0.0
+    # Development/test SQL budgets per request, see app/query_budget.py
+    QUERY_BUDGET_MODE: Literal["off", "log", "raise"] = "off"
+    QUERY_BUDGET_DEFAULT: Optional[int] = None
+    N_PLUS_ONE_THRESHOLD: int = 5
+    # Coalesce canvas drag writes and flush them in one transaction per interval
+    POSITION_BUFFER_ENABLED: bool = True
+    POSITION_FLUSH_INTERVAL_MS: int = 250
+    # "async" uses asyncpg/aiosqlite sessions, "sync" runs psycopg2/sqlite3 sessions in the threadpool
+    DATABASE_MODE: Literal["async", "sync"] = "async"
+    # Connection pool, per worker process: keep workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) under the server's connection limit
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 5
+    DB_POOL_TIMEOUT: float = 10.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # PostgreSQL statement_timeout in milliseconds, 0 disables it
+    DB_STATEMENT_TIMEOUT_MS: int = 15000
+    # Connections opened at startup so the first requests do not pay for the handshake
+    DB_POOL_WARM_CONNECTIONS: int = 2
+    # Check the schema against Alembic at startup; create tables on a fresh database
+    AUTO_CREATE_SCHEMA: bool = True
+    # Level for the app's own loggers (startup timings, maintenance jobs)
+    LOG_LEVEL: str = "INFO"
     
     @property
     def get_database_url(self) -> str:
@@ -25,6 +88,33 @@ class Settings(BaseSettings):
         
         return self.DATABASE_URL
 
-settings = Settings()
+    @property
+    def get_async_database_url(self) -> str:
+        # Swap in the async driver; asyncpg takes SSL through connect_args instead of the URL
+        if self.DATABASE_URL.startswith("sqlite"):
+            return self.DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+        if self.DATABASE_URL.startswith(("postgresql", "postgres")):
+            return "postgresql+asyncpg://" + self.DATABASE_URL.split("://", 1)[1]
+
+        return self.DATABASE_URL
 
-print("🔑 Loaded API Key:", settings.OPENAI_API_KEY)
\ No newline at end of file
+    @property
+    def get_connect_args(self) -> dict:
+        # SQLite connections are handed between threadpool workers in sync mode
+        if self.DATABASE_URL.startswith("sqlite"):
+            return {"check_same_thread": False}
+        if self.DATABASE_URL.startswith(("postgresql", "postgres")) and self.DB_STATEMENT_TIMEOUT_MS:
+            return {"options": f"-c statement_timeout={self.DB_STATEMENT_TIMEOUT_MS}"}
+        return {}
+
+    @property
+    def get_async_connect_args(self) -> dict:
+        if self.DATABASE_URL.startswith(("postgresql", "postgres")):
+            connect_args = {"ssl": "require"}
+            if self.DB_STATEMENT_TIMEOUT_MS:
+                connect_args["server_settings"] = {"statement_timeout": str(self.DB_STATEMENT_TIMEOUT_MS)}
+            return connect_args
+        return {}
+
+settings = Settings()
@@ -0,0 +1,159 @@
+import logging
+import random
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+NETLIFY_PREVIEW_REGEX = r"https://[a-z0-9-]+--life-os\.netlify\.app"  # Netlify deploy previews
+
+ALLOWED_ORIGINS = [
+    "http://localhost:3000",
+    "http://127.0.0.1:3000",
+    "https://life-os.netlify.app",  # Netlify production URL
+    "https://placeholder-username-93068.windsurf.build",  # Current deployment URL
+    "https://life-os-frontend-windsurf.build",  # Windsurf production URL
+    "https://life-os-frontend.windsurf.build",  # New Windsurf URL
+]
+
+ALLOW_METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+ALLOW_HEADERS = ["Accept", "Authorization", "Content-Type", "Idempotency-Key", "If-None-Match"]
+# Response headers the frontend reads: pagination cursor and dashboard ETag
+EXPOSE_HEADERS = ["ETag", "X-Next-Cursor"]
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class OriginMatcher:
+    """Exact allow-list first, then one precompiled regex; decisions are memoized"""
+
+    def __init__(self, origins: Iterable[str], regex: Optional[str] = None, cache_size: int = 256):
+        self.origins = frozenset(origins)
+        self.regex = re.compile(regex) if regex else None
+        self.cache_size = cache_size
+        self._cache: Dict[str, bool] = {}
+
+    def __call__(self, origin: str) -> bool:
+        allowed = self._cache.get(origin)
+        if allowed is None:
+            allowed = origin in self.origins or bool(self.regex and self.regex.fullmatch(origin))
+            # Arbitrary Origin values must not grow the cache without bound
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[origin] = allowed
+        return allowed
+
+
+class CORSMiddleware:
+    """CORS for the allow-list above, with preflights answered from prebuilt headers.
+
+    Preflights never reach routing. Their headers are built once per origin,
+    and Access-Control-Max-Age lets browsers skip repeating them. Logging is
+    sampled with CORS_LOG_SAMPLE_RATE (0 turns it off).
+    """
+
+    def __init__(self, app, matcher: OriginMatcher, max_age: int, log_sample_rate: float = 0.0):
+        self.app = app
+        self.matcher = matcher
+        self.log_sample_rate = log_sample_rate
+        self.allow_methods = frozenset(ALLOW_METHODS)
+        self.allow_headers = frozenset(h.lower() for h in ALLOW_HEADERS)
+        self._preflight_headers: Headers = [
+            (b"access-control-allow-credentials", b"true"),
+            (b"access-control-allow-methods", ", ".join(ALLOW_METHODS).encode()),
+            (b"access-control-allow-headers", ", ".join(ALLOW_HEADERS).encode()),
+            (b"access-control-max-age", str(max_age).encode()),
+            (b"vary", b"Origin"),
+            (b"content-length", b"0"),
+        ]
+        self._simple_headers: Headers = [
+            (b"access-control-allow-credentials", b"true"),
+            (b"access-control-expose-headers", ", ".join(EXPOSE_HEADERS).encode()),
+        ]
+        self._preflight_cache: Dict[bytes, Headers] = {}
+
+    def _sampled(self) -> bool:
+        return self.log_sample_rate > 0 and random.random() < self.log_sample_rate
+
+    def _preflight_response_headers(self, origin: bytes) -> Headers:
+        headers = self._preflight_cache.get(origin)
+        if headers is None:
+            headers = [(b"access-control-allow-origin", origin)] + self._preflight_headers
+            if len(self._preflight_cache) >= self.matcher.cache_size:
+                self._preflight_cache.clear()
+            self._preflight_cache[origin] = headers
+        return headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = request_method = request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+        allowed = self.matcher(origin.decode("latin-1"))
+
+        # Only a real preflight is answered here; plain OPTIONS requests go to the app
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            await self._preflight(scope, send, origin, allowed, request_method, request_headers)
+            return
+        if not allowed:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"access-control-allow-origin", origin))
+                headers.extend(self._simple_headers)
+                # Responses differ per origin, so caches must key on it
+                headers.append((b"vary", b"Origin"))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+    async def _preflight(self, scope, send, origin: bytes, allowed: bool, request_method, request_headers):
+        problem = None
+        if not allowed:
+            problem = "Disallowed CORS origin"
+        elif request_method.decode("latin-1").upper() not in self.allow_methods:
+            problem = "Disallowed CORS method"
+        elif request_headers is not None and not all(
+            h.strip().lower() in self.allow_headers
+            for h in request_headers.decode("latin-1").split(",") if h.strip()
+        ):
+            problem = "Disallowed CORS headers"
+
+        if self._sampled():
+            logger.info(
+                "CORS preflight %s origin=%s method=%s headers=%s -> %s",
+                scope["path"], origin.decode("latin-1"),
+                request_method.decode("latin-1"),
+                request_headers and request_headers.decode("latin-1"),
+                problem or "ok",
+            )
+
+        if problem:
+            body = problem.encode()
+            await send({"type": "http.response.start", "status": 400, "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+                (b"vary", b"Origin"),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        await send({"type": "http.response.start", "status": 200, "headers": self._preflight_response_headers(origin)})
+        await send({"type": "http.response.body", "body": b""})
+
@@ -1,15 +1,168 @@
-from sqlalchemy import create_engine
+import time
+from contextlib import asynccontextmanager
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from .config import settings
+from . import metrics
+from .instrumentation import instrument_queries
 
-engine = create_engine(settings.get_database_url)
+
+def _timed_pool(pool_class, engine_name: str):
+    """Subclass a QueuePool so the time spent waiting for a connection is observed"""
+
+    class TimedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            except PoolTimeoutError:
+                metrics.DB_POOL_TIMEOUTS.labels(engine_name).inc()
+                raise
+            finally:
+                metrics.DB_POOL_CHECKOUT_WAIT.labels(engine_name).observe(time.perf_counter() - start)
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    # SQLAlchemy names pool loggers after the class; keep this one under sqlalchemy.pool like its base
+    TimedPool.__module__ = pool_class.__module__
+    return TimedPool
+
+
+def _pool_options(url: str, pool_class, engine_name: str) -> dict:
+    # In-memory SQLite uses a single shared connection, there is nothing to size
+    if url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith(":")):
+        return {}
+    return {
+        "poolclass": _timed_pool(pool_class, engine_name),
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
+def instrument_pool(sync_engine, engine_name: str):
+    """Attach pool event listeners and register the pool for scrape-time gauges"""
+
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        metrics.DB_POOL_CONNECTS.labels(engine_name).inc()
+
+    @event.listens_for(sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.DB_POOL_CHECKOUTS.labels(engine_name).inc()
+
+    @event.listens_for(sync_engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.DB_POOL_INVALIDATIONS.labels(engine_name).inc()
+
+    metrics.pool_collector.register(engine_name, sync_engine.pool)
+
+
+engine = create_engine(
+    settings.get_database_url,
+    connect_args=settings.get_connect_args,
+    **_pool_options(settings.get_database_url, QueuePool, "sync"),
+)
+instrument_pool(engine, "sync")
+instrument_queries(engine, "sync")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+if settings.DATABASE_MODE == "async":
+    async_engine = create_async_engine(
+        settings.get_async_database_url,
+        connect_args=settings.get_async_connect_args,
+        **_pool_options(settings.get_async_database_url, AsyncAdaptedQueuePool, "async"),
+    )
+    instrument_pool(async_engine.sync_engine, "async")
+    instrument_queries(async_engine.sync_engine, "async")
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+else:
+    async_engine = None
+    AsyncSessionLocal = None
+
+# Sessions used by the sync adapter must not expire on commit either, otherwise
+# attribute access after commit would emit blocking IO on the event loop
+_ThreadedSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+
+class ThreadedSession:
+    """AsyncSession-compatible wrapper that runs a sync Session in the threadpool.
+
+    Used when DATABASE_MODE is "sync" so handlers are written once against the
+    async API while still using the psycopg2/sqlite3 drivers.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    def _execute_buffered(self, statement, *args, **kwargs):
+        # Fetch rows on the worker thread, like AsyncSession does
+        result = self.sync_session.execute(statement, *args, **kwargs)
+        # ORM bulk INSERTs return an IteratorResult with no rows and no `returns_rows`
+        if getattr(result._metadata, "returns_rows", True):
+            return result.freeze()()
+        return result
+
+    async def execute(self, statement, *args, **kwargs):
+        return await run_in_threadpool(self._execute_buffered, statement, *args, **kwargs)
+
+    async def scalar(self, statement, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, statement, *args, **kwargs)
+
+    async def scalars(self, statement, *args, **kwargs):
+        result = await self.execute(statement, *args, **kwargs)
+        return result.scalars()
+
+    async def get(self, entity, ident, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kwargs)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def refresh(self, instance, *args, **kwargs):
+        await run_in_threadpool(self.sync_session.refresh, instance, *args, **kwargs)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+@asynccontextmanager
+async def session_scope():
+    """Session for work outside a request (background jobs, flushers)"""
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+
+    db = ThreadedSession(_ThreadedSessionLocal())
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+
+
+async def get_db():
+    async with session_scope() as db:
+        yield db
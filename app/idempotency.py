@@ -0,0 +1,76 @@
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Optional
+from fastapi import HTTPException, Request
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+
+
+def body_hash(body: Optional[BaseModel]) -> str:
+    """Hash of the validated request body, so formatting differences don't count"""
+    payload = body.model_dump_json() if body is not None else ""
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def stored_key(db: AsyncSession, user_id: int, key: str) -> Optional[models.IdempotencyKey]:
+    return await db.scalar(select(models.IdempotencyKey).where(
+        models.IdempotencyKey.user_id == user_id,
+        models.IdempotencyKey.key == key,
+    ))
+
+
+def replay(stored: models.IdempotencyKey, method: str, path: str, request_hash: str) -> Any:
+    """The stored response, or 422 if the key was first used for a different request"""
+    # Keys stored before requests were recorded have no method; they expire with the TTL
+    if stored.method is not None and (stored.method, stored.path, stored.body_hash) != (method, path, request_hash):
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used for a different request",
+        )
+    return json.loads(stored.response)
+
+
+async def run_once(
+    db: AsyncSession,
+    user_id: int,
+    key: Optional[str],
+    operation: Callable[[], Awaitable[Any]],
+    request: Request,
+    body: Optional[BaseModel] = None,
+) -> Any:
+    """Run `operation` and commit, at most once per (user, Idempotency-Key).
+
+    The key is stored in the same transaction as the operation's writes, so a
+    retry either replays the stored response or finds nothing was applied.
+    The method, path and body hash are stored with it; reusing a key for a
+    different request is rejected with 422 instead of replaying. Two
+    concurrent requests with the same key race on the unique constraint;
+    the loser rolls back its writes and returns the winner's response.
+    """
+    if key is None:
+        response = await operation()
+        await db.commit()
+        return response
+
+    method, path, request_hash = request.method, request.url.path, body_hash(body)
+    previous = await stored_key(db, user_id, key)
+    if previous is not None:
+        return replay(previous, method, path, request_hash)
+
+    response = await operation()
+    db.add(models.IdempotencyKey(
+        user_id=user_id, key=key, method=method, path=path, body_hash=request_hash,
+        response=json.dumps(response),
+    ))
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        previous = await stored_key(db, user_id, key)
+        if previous is None:
+            raise
+        return replay(previous, method, path, request_hash)
+    return response
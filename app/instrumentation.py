@@ -0,0 +1,110 @@
+import re
+import time
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from . import metrics
+
+
+# A bind placeholder in any paramstyle, or a literal already replaced by "?"
+_PLACEHOLDER = r"(?:\?|%\(\w+\)s|%s|\$\d+|\$\?|:\w+)"
+_IN_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})*\s*\)")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """Statement shape with literals and IN-list lengths removed"""
+    statement = _STRING.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = _IN_LIST.sub("(?)", statement)
+    return _SPACE.sub(" ", statement).strip()
+
+
+class QueryStats:
+    """SQL statements executed on behalf of the current request"""
+
+    __slots__ = ("count", "seconds", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        # Counter of statement fingerprints, only kept when query budgets are on
+        self.statements = None
+
+
+# Set by RequestMetricsMiddleware; background tasks see None and are not counted.
+# Both the asyncio greenlet bridge and run_in_threadpool carry the context over.
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    return _query_stats.get()
+
+
+def instrument_queries(sync_engine, engine_name: str):
+    """Time every statement and add it to the current request's QueryStats"""
+    histogram = metrics.DB_QUERY_DURATION.labels(engine_name)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        histogram.observe(elapsed)
+        stats = _query_stats.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+            if stats.statements is not None:
+                stats.statements[fingerprint(statement)] += 1
+
+
+def route_template(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class RequestMetricsMiddleware:
+    """Latency, status, in-flight and SQL usage per route template.
+
+    Plain ASGI rather than BaseHTTPMiddleware, so streaming responses are
+    timed to their last chunk and the request context is not copied into a
+    separate task.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        in_flight = metrics.HTTP_REQUESTS_IN_FLIGHT.labels(method)
+        stats = QueryStats()
+        token = _query_stats.set(stats)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_flight.dec()
+            _query_stats.reset(token)
+            route = route_template(scope)
+            metrics.HTTP_REQUEST_DURATION.labels(method, route, str(status_code)).observe(elapsed)
+            metrics.DB_QUERIES_PER_REQUEST.labels(route).observe(stats.count)
+            metrics.DB_TIME_PER_REQUEST.labels(route).observe(stats.seconds)
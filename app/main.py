@@ -1,95 +1,95 @@
-from datetime import datetime, timedelta
-from typing import List
-from fastapi import Depends, FastAPI, HTTPException, status, Request, Response
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import List, Literal, Optional
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, status, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from . import models, auth, ai_coach
-from .schemas import auth_schemas, core_schemas, task_schemas, ai_coach_schemas
-from .routers import items
-from .database import engine, get_db
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from . import models, auth, ai_coach, idempotency, metrics, progression, rewards, startup
+from .schemas import auth_schemas, core_schemas, task_schemas, ai_coach_schemas, dashboard_schemas
+from .routers import canvas, items
+from .database import get_db
+from .cors import ALLOWED_ORIGINS, NETLIFY_PREVIEW_REGEX, CORSMiddleware, OriginMatcher
+from .instrumentation import RequestMetricsMiddleware
+from .query_budget import QueryBudgetMiddleware, query_budget
+from .pagination import MAX_PAGE_SIZE, fetch_page
+from .position_buffer import position_buffer
+from .streaks import streak_scheduler
 from .config import settings
+import hashlib
+import json
 import logging
 import re
 
-models.Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Life OS API")
-
-# Configure CORS *before* including routers or other middleware
-NETLIFY_MAIN = "https://life-os.netlify.app"
-NETLIFY_PREVIEW_REGEX = r"https:\/\/[a-z0-9-]+--life-os\.netlify\.app"  # Regex for previews
-LOCAL_DEV = "http://localhost:3000"
-LOCAL_DEV_ALT = "http://127.0.0.1:3000"
-WINDSURF_DEV_PLACEHOLDER = "https://placeholder-username-93068.windsurf.build"
-WINDSURF_DEV_ACTUAL = "https://life-os-frontend-windsurf.build"
-
-# Combine all allowed origins
-allowed_origins_list = [
-    LOCAL_DEV,
-    LOCAL_DEV_ALT,
-    WINDSURF_DEV_PLACEHOLDER,
-    WINDSURF_DEV_ACTUAL,
-    NETLIFY_MAIN,
-    "https://placeholder-username-93068.windsurf.build",  # Current deployment URL
-    "https://life-os.netlify.app",  # Netlify production URL
-    "https://life-os-frontend-windsurf.build",  # Windsurf production URL
-    "https://life-os-frontend.windsurf.build",  # New Windsurf URL
-]
-
-# Add CORS middleware first
+startup.configure_logging()
+startup_logger = logging.getLogger("app.startup")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    timer = startup.StartupTimer()
+    with timer.phase("schema"):
+        schema = await run_in_threadpool(startup.prepare_schema)
+    with timer.phase("db_pool"):
+        await startup.warm_pool()
+    with timer.phase("openai_client"):
+        try:
+            ai_coach.init_openai_client()
+        except ValueError as exc:
+            # Coach endpoints will surface the error; everything else still serves
+            startup_logger.warning("OpenAI client not initialised: %s", exc)
+    with timer.phase("background_tasks"):
+        if settings.POSITION_BUFFER_ENABLED:
+            position_buffer.start()
+        if settings.STREAK_MAINTENANCE_ENABLED:
+            streak_scheduler.start()
+    startup_logger.info("Schema check: %s", schema)
+    timer.log()
+
+    yield
+
+    # Write out drags that are still pending
+    await position_buffer.stop()
+    await streak_scheduler.stop()
+    await ai_coach.close_openai_client()
+
+app = FastAPI(title="Life OS API", lifespan=lifespan)
+
+# CORS: allow-list plus Netlify previews; preflights are answered without routing
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=allowed_origins_list,  # Use our specific list of allowed origins
-    allow_origin_regex=NETLIFY_PREVIEW_REGEX,
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization", "Accept"]
+    matcher=OriginMatcher(ALLOWED_ORIGINS, NETLIFY_PREVIEW_REGEX),
+    max_age=settings.CORS_MAX_AGE,
+    log_sample_rate=settings.CORS_LOG_SAMPLE_RATE,
 )
 
-# Add detailed logging for preflight requests
-logger = logging.getLogger('cors_debug')
-logger.setLevel(logging.INFO)
-
-# Force a handler for /users/ OPTIONS requests before anything else
-@app.options('/users/', status_code=200)
-async def options_users_handler(request: Request):
-    origin = request.headers.get('origin', 'unknown')
-    method = request.headers.get('access-control-request-method', 'unknown')
-    headers = request.headers.get('access-control-request-headers', 'unknown')
-    logger.info(f"CORS preflight OPTIONS request for /users/ - Origin: {origin}, Method: {method}, Headers: {headers}, Full Headers: {dict(request.headers)}")
-    logger.warning(f"CORS preflight debug for /users/ - This should always return 200")
-    return Response(status_code=200, headers={
-        "Access-Control-Allow-Origin": origin if origin != 'unknown' else '*',
-        "Access-Control-Allow-Credentials": "true",
-        "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-        "Access-Control-Allow-Headers": headers if headers != 'unknown' else '*'
-    })
-
-@app.options("{path:path}")
-async def options_handler(request: Request, path: str):
-    origin = request.headers.get('origin', 'unknown')
-    method = request.headers.get('access-control-request-method', 'unknown')
-    headers = request.headers.get('access-control-request-headers', 'unknown')
-    logger.info(f"CORS preflight OPTIONS request - Path: {path}, Origin: {origin}, Method: {method}, Headers: {headers}, Full Headers: {dict(request.headers)}")
-    return Response(status_code=200, headers={
-        "Access-Control-Allow-Origin": origin if origin != 'unknown' else '*',
-        "Access-Control-Allow-Credentials": "true",
-        "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-        "Access-Control-Allow-Headers": headers if headers != 'unknown' else '*'
-    })
+# Development/test query budgets; inside the metrics middleware, which counts the queries
+if settings.QUERY_BUDGET_MODE != "off":
+    app.add_middleware(QueryBudgetMiddleware, mode=settings.QUERY_BUDGET_MODE)
+
+# Outermost, so latency includes CORS handling
+app.add_middleware(RequestMetricsMiddleware)
 
 # Include routers *after* adding middleware
 app.include_router(items.router)
+app.include_router(canvas.router)
+
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    body, content_type = metrics.render_latest()
+    return Response(content=body, media_type=content_type)
 
 # Auth endpoints
 @app.post("/token", response_model=auth_schemas.Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+    user = await db.scalar(select(models.User).where(models.User.username == form_data.username))
+    if not user or not await auth.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -97,7 +97,7 @@ async def login_for_access_token(
         )
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=auth.token_claims(user), expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -111,269 +111,450 @@ async def auth_login_alias(request: Request):
 
 # User endpoints
 @app.post("/users/", response_model=auth_schemas.User)
-def create_user(user: auth_schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(
-        (models.User.username == user.username) | 
+async def create_user(user: auth_schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await db.scalar(select(models.User).where(
+        (models.User.username == user.username) |
         (models.User.email == user.email)
-    ).first()
+    ).limit(1))
     if db_user:
         raise HTTPException(status_code=400, detail="Username or email already registered")
-    hashed_password = auth.get_password_hash(user.password)
+    hashed_password = await auth.get_password_hash_async(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 # Updated GET /users/me endpoint without trailing slash to fix 405 error
 @app.get("/users/me", response_model=auth_schemas.User)
 async def read_users_me(current_user: models.User = Depends(auth.get_current_active_user)):
-    print(f"[DEBUG] /users/me endpoint called, user: {current_user.username}")
     return current_user
 
-# Add cascading delete for identities
-def delete_identity_cascade(db: Session, identity_id: int):
-    # Delete linked skills first
-    skills = db.query(models.Skill).filter(models.Skill.identity_id == identity_id).all()
-    for skill in skills:
-        delete_skill_cascade(db, skill.id)
-    
-    # Delete linked tasks
-    db.query(models.Task).filter(models.Task.identity_id == identity_id).delete()
-    
-    # Delete the identity
-    db.query(models.Identity).filter(models.Identity.id == identity_id).delete()
+# Everything the main screen needs, in one response and a fixed number of queries
+@app.get("/dashboard", response_model=dashboard_schemas.Dashboard)
+@query_budget(7)
+async def read_dashboard(
+    request: Request,
+    tasks_limit: int = Query(100, ge=0, le=MAX_PAGE_SIZE),
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    identities = (await db.scalars(
+        select(models.Identity)
+        .where(models.Identity.user_id == current_user.id)
+        .options(selectinload(models.Identity.skills).selectinload(models.Skill.habits))
+        .order_by(models.Identity.id)
+    )).all()
+    loose_habits = (await db.scalars(
+        select(models.Habit)
+        .where(models.Habit.user_id == current_user.id, models.Habit.skill_id.is_(None))
+        .order_by(models.Habit.id)
+    )).all()
+    pending_tasks = (await db.scalars(
+        select(models.Task)
+        .where(models.Task.user_id == current_user.id, models.Task.completed == False)
+        .order_by(models.Task.id.desc())
+        .limit(tasks_limit)
+    )).all()
+
+    skills = [skill for identity in identities for skill in identity.skills]
+    position_buffer.overlay("identities", identities)
+    position_buffer.overlay("skills", skills)
+    position_buffer.overlay("habits", [habit for skill in skills for habit in skill.habits] + list(loose_habits))
+
+    body = dashboard_schemas.Dashboard(
+        user=current_user,
+        identities=identities,
+        habits=loose_habits,
+        pending_tasks=pending_tasks,
+    ).model_dump_json().encode()
+
+    # Let the client revalidate instead of downloading an unchanged tree
+    etag = f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Cascading deletes run a fixed number of set-based statements, whatever the size of the tree
+async def delete_identity_cascade(db: AsyncSession, identity_id: int):
+    skill_ids = select(models.Skill.id).where(models.Skill.identity_id == identity_id)
+
+    # Delete habits of linked skills, with their completion log
+    habit_ids = select(models.Habit.id).where(models.Habit.skill_id.in_(skill_ids))
+    await db.execute(
+        delete(models.HabitCompletion).where(models.HabitCompletion.habit_id.in_(habit_ids)).execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        delete(models.Habit).where(models.Habit.skill_id.in_(skill_ids)).execution_options(synchronize_session=False)
+    )
+
+    # Delete tasks linked to the identity or to any of its skills
+    await db.execute(
+        delete(models.Task).where(
+            (models.Task.identity_id == identity_id) | models.Task.skill_id.in_(skill_ids)
+        ).execution_options(synchronize_session=False)
+    )
+
+    # Delete linked skills, then the identity
+    await db.execute(
+        delete(models.Skill).where(models.Skill.identity_id == identity_id).execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        delete(models.Identity).where(models.Identity.id == identity_id).execution_options(synchronize_session=False)
+    )
+
+async def delete_skill_cascade(db: AsyncSession, skill_id: int):
+    # Delete linked habits, with their completion log
+    habit_ids = select(models.Habit.id).where(models.Habit.skill_id == skill_id)
+    await db.execute(
+        delete(models.HabitCompletion).where(models.HabitCompletion.habit_id.in_(habit_ids)).execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        delete(models.Habit).where(models.Habit.skill_id == skill_id).execution_options(synchronize_session=False)
+    )
 
-# Add cascading delete for skills
-def delete_skill_cascade(db: Session, skill_id: int):
-    # Delete linked habits
-    db.query(models.Habit).filter(models.Habit.skill_id == skill_id).delete()
-    
     # Delete linked tasks
-    db.query(models.Task).filter(models.Task.skill_id == skill_id).delete()
-    
+    await db.execute(
+        delete(models.Task).where(models.Task.skill_id == skill_id).execution_options(synchronize_session=False)
+    )
+
     # Delete the skill
-    db.query(models.Skill).filter(models.Skill.id == skill_id).delete()
+    await db.execute(
+        delete(models.Skill).where(models.Skill.id == skill_id).execution_options(synchronize_session=False)
+    )
 
 # Identity endpoints
 @app.post("/identities/", response_model=core_schemas.Identity)
-def create_identity(
+async def create_identity(
     identity: core_schemas.IdentityCreate,
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     db_identity = models.Identity(**identity.model_dump(), user_id=current_user.id)
     db.add(db_identity)
-    db.commit()
-    db.refresh(db_identity)
+    await db.commit()
+    await db.refresh(db_identity)
     return db_identity
 
 @app.get("/identities/", response_model=List[core_schemas.Identity])
-def read_identities(
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+@query_budget(2)
+async def read_identities(
+    response: Response,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    fields: Optional[str] = None,
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    return await fetch_page(
+        db, models.Identity, [models.Identity.user_id == current_user.id], response,
+        core_schemas.Identity, limit, after, fields, position_type="identities",
+    )
+
+@app.delete("/identities/{identity_id}")
+@query_budget(7)
+async def delete_identity(
+    identity_id: int,
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
-    return db.query(models.Identity).filter(models.Identity.user_id == current_user.id).all()
+    owned = await db.scalar(select(models.Identity.id).where(
+        models.Identity.id == identity_id,
+        models.Identity.user_id == current_user.id
+    ))
+    if not owned:
+        raise HTTPException(status_code=404, detail="Identity not found")
+
+    await delete_identity_cascade(db, identity_id)
+    await db.commit()
+    return {"status": "success"}
 
 # Skill endpoints
 @app.post("/skills/", response_model=core_schemas.Skill)
-def create_skill(
+async def create_skill(
     skill: core_schemas.SkillCreate,
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
-    identity = db.query(models.Identity).filter(
+    identity = await db.scalar(select(models.Identity).where(
         models.Identity.id == skill.identity_id,
         models.Identity.user_id == current_user.id
-    ).first()
+    ))
     if not identity:
         raise HTTPException(status_code=404, detail="Identity not found")
     
     db_skill = models.Skill(**skill.model_dump())
     db.add(db_skill)
-    db.commit()
-    db.refresh(db_skill)
+    await db.commit()
+    await db.refresh(db_skill)
     return db_skill
 
 @app.get("/skills/", response_model=List[core_schemas.Skill])
-def read_skills(
+@query_budget(2)
+async def read_skills(
     identity_id: int,
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    fields: Optional[str] = None,
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    owned_identities = select(models.Identity.id).where(models.Identity.user_id == current_user.id)
+    return await fetch_page(
+        db, models.Skill,
+        [models.Skill.identity_id == identity_id, models.Skill.identity_id.in_(owned_identities)],
+        response, core_schemas.Skill, limit, after, fields, position_type="skills",
+    )
+
+@app.delete("/skills/{skill_id}")
+@query_budget(6)
+async def delete_skill(
+    skill_id: int,
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
-    return db.query(models.Skill).filter(models.Skill.identity_id == identity_id).all()
+    owned = await db.scalar(select(models.Skill.id).join(models.Identity).where(
+        models.Skill.id == skill_id,
+        models.Identity.user_id == current_user.id
+    ))
+    if not owned:
+        raise HTTPException(status_code=404, detail="Skill not found")
+
+    await delete_skill_cascade(db, skill_id)
+    await db.commit()
+    return {"status": "success"}
 
 # Habit endpoints
 @app.post("/habits/", response_model=core_schemas.Habit)
-def create_habit(
+async def create_habit(
     habit: core_schemas.HabitCreate,
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     if habit.skill_id:
-        skill = db.query(models.Skill).filter(models.Skill.id == habit.skill_id).first()
+        skill = await db.get(models.Skill, habit.skill_id)
         if not skill:
             raise HTTPException(status_code=404, detail="Skill not found")
     
     db_habit = models.Habit(**habit.model_dump(), user_id=current_user.id)
     db.add(db_habit)
-    db.commit()
-    db.refresh(db_habit)
+    await db.commit()
+    await db.refresh(db_habit)
     return db_habit
 
+@app.get("/habits/", response_model=List[core_schemas.Habit])
+@query_budget(2)
+async def read_habits(
+    response: Response,
+    skill_id: Optional[int] = None,
+    streak_status: Optional[Literal["done", "at_risk", "due"]] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    fields: Optional[str] = None,
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    filters = [models.Habit.user_id == current_user.id]
+    if skill_id is not None:
+        filters.append(models.Habit.skill_id == skill_id)
+    if streak_status is not None:
+        filters.append(models.Habit.streak_status == streak_status)
+    return await fetch_page(
+        db, models.Habit, filters, response, core_schemas.Habit, limit, after, fields, position_type="habits",
+    )
+
+@app.post("/habits/complete", response_model=List[task_schemas.CompletionResult])
+@query_budget(10)
+async def complete_habits(
+    body: task_schemas.BulkComplete,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    async def complete():
+        return await rewards.complete_habits(db, current_user.id, body.ids)
+
+    return await idempotency.run_once(db, current_user.id, idempotency_key, complete, request, body)
+
 @app.post("/habits/{habit_id}/complete")
-def complete_habit(
+@query_budget(10)
+async def complete_habit(
     habit_id: int,
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
-    habit = db.query(models.Habit).filter(
-        models.Habit.id == habit_id,
-        models.Habit.user_id == current_user.id
-    ).first()
-    if not habit:
-        raise HTTPException(status_code=404, detail="Habit not found")
-
-    # Update streak and last_completed
-    if habit.last_completed:
-        time_since_last = datetime.utcnow() - habit.last_completed
-        if time_since_last.days > 1:
-            habit.streak = 1
-        else:
-            habit.streak += 1
-    else:
-        habit.streak = 1
-    habit.last_completed = datetime.utcnow()
-
-    # Award rewards
-    current_user.exp += habit.exp_reward
-    current_user.chrono_points += habit.chrono_reward
-
-    # Update skill exp if applicable
-    if habit.skill_id:
-        skill = db.query(models.Skill).filter(models.Skill.id == habit.skill_id).first()
-        if skill:
-            skill.exp += habit.exp_reward
+    async def complete():
+        result = await rewards.complete_habit(db, current_user.id, habit_id)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Habit not found")
+        return result
 
-    db.commit()
-    return {"status": "success", "streak": habit.streak}
+    return await idempotency.run_once(db, current_user.id, idempotency_key, complete, request)
 
 # Task endpoints
 @app.post("/tasks/", response_model=task_schemas.Task)
-def create_task(
+async def create_task(
     task: task_schemas.TaskCreate,
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     db_task = models.Task(**task.model_dump(), user_id=current_user.id)
     db.add(db_task)
-    db.commit()
-    db.refresh(db_task)
+    await db.commit()
+    await db.refresh(db_task)
     return db_task
 
+@app.get("/tasks/", response_model=List[task_schemas.Task])
+@query_budget(2)
+async def read_tasks(
+    response: Response,
+    completed: Optional[bool] = None,
+    skill_id: Optional[int] = None,
+    identity_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    fields: Optional[str] = None,
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    filters = [models.Task.user_id == current_user.id]
+    if completed is not None:
+        filters.append(models.Task.completed == completed)
+    if skill_id is not None:
+        filters.append(models.Task.skill_id == skill_id)
+    if identity_id is not None:
+        filters.append(models.Task.identity_id == identity_id)
+    return await fetch_page(db, models.Task, filters, response, task_schemas.Task, limit, after, fields)
+
+@app.post("/tasks/complete", response_model=List[task_schemas.CompletionResult])
+@query_budget(13)
+async def complete_tasks(
+    body: task_schemas.BulkComplete,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    async def complete():
+        return await rewards.complete_tasks(db, current_user.id, body.ids)
+
+    return await idempotency.run_once(db, current_user.id, idempotency_key, complete, request, body)
+
 @app.post("/tasks/{task_id}/complete")
-def complete_task(
+@query_budget(13)
+async def complete_task(
     task_id: int,
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
-    task = db.query(models.Task).filter(
-        models.Task.id == task_id,
-        models.Task.user_id == current_user.id
-    ).first()
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
-
-    if not task.completed:
-        task.completed = True
-        current_user.exp += task.exp_reward
-        current_user.chrono_points += task.chrono_reward
-
-        # Update skill exp if applicable
-        if task.skill_id:
-            skill = db.query(models.Skill).filter(models.Skill.id == task.skill_id).first()
-            if skill:
-                skill.exp += task.exp_reward
-
-        # Update identity exp if applicable
-        if task.identity_id:
-            identity = db.query(models.Identity).filter(models.Identity.id == task.identity_id).first()
-            if identity:
-                identity.exp += task.exp_reward
-
-        db.commit()
-    return {"status": "success"}
+    async def complete():
+        result = await rewards.complete_task(db, current_user.id, task_id)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        return result
+
+    return await idempotency.run_once(db, current_user.id, idempotency_key, complete, request)
 
 # Level up endpoints
 @app.post("/identities/{identity_id}/level-up")
-def level_up_identity(
+async def level_up_identity(
     identity_id: int,
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
-    identity = db.query(models.Identity).filter(
+    identity = await db.scalar(select(models.Identity).where(
         models.Identity.id == identity_id,
         models.Identity.user_id == current_user.id
-    ).first()
+    ))
     if not identity:
         raise HTTPException(status_code=404, detail="Identity not found")
 
-    levels_gained = 0
-    while identity.exp >= 100:
-        identity.level += 1
-        identity.exp -= 100
-        levels_gained += 1
+    # Awards level up automatically; this settles rows from before that, or after a curve change
+    old_level = identity.level or 1
+    identity.level, identity.exp = progression.curve.normalize(identity.level, identity.exp)
+    levels_gained = identity.level - old_level
 
     if levels_gained > 0:
-        db.commit()
+        await db.commit()
         return {"status": "success", "levels_gained": levels_gained, "new_level": identity.level}
     return {"status": "no_change"}
 
 @app.post("/skills/{skill_id}/level-up")
-def level_up_skill(
+async def level_up_skill(
     skill_id: int,
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: auth_schemas.Principal = Depends(auth.get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
-    skill = db.query(models.Skill).join(models.Identity).filter(
+    skill = await db.scalar(select(models.Skill).join(models.Identity).where(
         models.Skill.id == skill_id,
         models.Identity.user_id == current_user.id
-    ).first()
+    ))
     if not skill:
         raise HTTPException(status_code=404, detail="Skill not found")
 
-    levels_gained = 0
-    while skill.exp >= 100:
-        skill.level += 1
-        skill.exp -= 100
-        levels_gained += 1
+    # Awards level up automatically; this settles rows from before that, or after a curve change
+    old_level = skill.level or 1
+    skill.level, skill.exp = progression.curve.normalize(skill.level, skill.exp)
+    levels_gained = skill.level - old_level
 
     if levels_gained > 0:
-        db.commit()
+        await db.commit()
         return {"status": "success", "levels_gained": levels_gained, "new_level": skill.level}
     return {"status": "no_change"}
 
 # AI Coach endpoints
+def coach_event_stream(http_request: Request, user_input: str, persona: str, context: dict) -> StreamingResponse:
+    """Server-Sent Events response: one `data: {"delta": ...}` event per chunk, then `event: done`"""
+    async def events():
+        try:
+            async for delta in ai_coach.stream_ai_coach_response(
+                user_input, persona, context, is_disconnected=http_request.is_disconnected
+            ):
+                yield f"data: {json.dumps({'delta': delta})}\n\n"
+        except Exception as exc:
+            logging.getLogger(__name__).exception("AI coach stream failed")
+            yield f"event: error\ndata: {json.dumps({'detail': str(exc)})}\n\n"
+            return
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/identities/{identity_id}/ai-coach")
+@query_budget(4)
 async def get_identity_ai_coach(
     identity_id: int,
     request: ai_coach_schemas.AICoachRequest,
+    http_request: Request,
+    stream: bool = False,
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    identity = db.query(models.Identity).filter(
+    identity = await db.scalar(select(models.Identity).where(
         models.Identity.id == identity_id,
         models.Identity.user_id == current_user.id
-    ).first()
+    ))
     if not identity:
         raise HTTPException(status_code=404, detail="Identity not found")
 
-    context = ai_coach.get_user_context(db, current_user, identity_id=identity_id)
-    response = ai_coach.get_ai_coach_response(
+    context = await ai_coach.get_user_context(db, current_user, identity_id=identity_id)
+    if stream:
+        return coach_event_stream(http_request, request.user_input, identity.ai_coach_persona, context)
+    response = await ai_coach.get_ai_coach_response(
         request.user_input,
         identity.ai_coach_persona,
         context
@@ -381,21 +562,26 @@ async def get_identity_ai_coach(
     return {"response": response}
 
 @app.post("/skills/{skill_id}/ai-coach")
+@query_budget(4)
 async def get_skill_ai_coach(
     skill_id: int,
     request: ai_coach_schemas.AICoachRequest,
+    http_request: Request,
+    stream: bool = False,
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    skill = db.query(models.Skill).join(models.Identity).filter(
+    skill = await db.scalar(select(models.Skill).join(models.Identity).where(
         models.Skill.id == skill_id,
         models.Identity.user_id == current_user.id
-    ).first()
+    ))
     if not skill:
         raise HTTPException(status_code=404, detail="Skill not found")
 
-    context = ai_coach.get_user_context(db, current_user, skill_id=skill_id)
-    response = ai_coach.get_ai_coach_response(
+    context = await ai_coach.get_user_context(db, current_user, skill_id=skill_id)
+    if stream:
+        return coach_event_stream(http_request, request.user_input, skill.ai_coach_persona, context)
+    response = await ai_coach.get_ai_coach_response(
         request.user_input,
         skill.ai_coach_persona,
         context
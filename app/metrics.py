@@ -0,0 +1,107 @@
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+# Connection pool metrics, fed by the pool hooks in app/database.py
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the pool",
+    ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+DB_POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Connections checked out of the pool", ["engine"])
+DB_POOL_CONNECTS = Counter("db_pool_connects_total", "New DBAPI connections opened by the pool", ["engine"])
+DB_POOL_INVALIDATIONS = Counter("db_pool_invalidations_total", "Pooled connections invalidated (e.g. failed pre-ping)", ["engine"])
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Checkouts that gave up after pool_timeout", ["engine"])
+
+# Password hashing, see auth._run_password_op
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_seconds",
+    "bcrypt hash/verify execution time",
+    ["operation"],
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2, 5),
+)
+PASSWORD_HASH_QUEUE_WAIT = Histogram(
+    "password_hash_queue_wait_seconds",
+    "Time spent waiting for a password hashing slot",
+    ["operation"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+PASSWORD_HASH_REJECTED = Counter("password_hash_rejected_total", "Hash/verify requests rejected with 503 because the pool was saturated", ["operation"])
+
+COACH_CACHE_REQUESTS = Counter("coach_cache_requests_total", "AI coach response cache lookups", ["result"])
+
+# Per-request metrics, see app/instrumentation.py. `route` is the path template, never the raw path
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route template",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being served", ["method"])
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "SQL statements executed while serving one request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds",
+    "Time spent executing SQL while serving one request",
+    ["route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Execution time of single SQL statements",
+    ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+# OpenAI calls made by the AI coach
+OPENAI_REQUEST_DURATION = Histogram(
+    "openai_request_duration_seconds",
+    "Chat completion call time, until the last streamed chunk for streams",
+    ["model", "mode", "outcome"],
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+OPENAI_TOKENS = Counter("openai_tokens_total", "Tokens reported by the OpenAI usage field", ["model", "kind"])
+
+STARTUP_PHASE_SECONDS = Gauge("app_startup_phase_seconds", "Duration of each phase of the last worker startup", ["phase"])
+
+
+class PoolCollector:
+    """Reports live pool occupancy at scrape time"""
+
+    def __init__(self):
+        self.pools = {}
+
+    def register(self, name: str, pool):
+        self.pools[name] = pool
+
+    def collect(self):
+        families = {
+            "size": GaugeMetricFamily("db_pool_size", "Configured number of persistent connections", labels=["engine"]),
+            "max": GaugeMetricFamily("db_pool_max_connections", "pool_size + max_overflow, the most connections this worker can open", labels=["engine"]),
+            "checked_out": GaugeMetricFamily("db_pool_checked_out", "Connections currently in use", labels=["engine"]),
+            "checked_in": GaugeMetricFamily("db_pool_checked_in", "Idle connections held by the pool", labels=["engine"]),
+            "overflow": GaugeMetricFamily("db_pool_overflow", "Connections open beyond pool_size", labels=["engine"]),
+        }
+        for name, pool in self.pools.items():
+            # Only QueuePool-style pools expose occupancy
+            if not hasattr(pool, "checkedout"):
+                continue
+            families["size"].add_metric([name], pool.size())
+            families["max"].add_metric([name], pool.size() + max(pool._max_overflow, 0))
+            families["checked_out"].add_metric([name], pool.checkedout())
+            families["checked_in"].add_metric([name], pool.checkedin())
+            families["overflow"].add_metric([name], max(pool.overflow(), 0))
+        return list(families.values())
+
+
+pool_collector = PoolCollector()
+REGISTRY.register(pool_collector)
+
+
+def render_latest():
+    """Return (body, content_type) for the Prometheus text exposition"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
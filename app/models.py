@@ -1,8 +1,18 @@
 from datetime import datetime
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Column, Date, DateTime, ForeignKey, Index, Integer, String, Text, UniqueConstraint, bindparam, update
 from sqlalchemy.orm import relationship
 from .database import Base
 
+
+def update_by_id(model, **values):
+    """executemany-able UPDATE keyed on a `row_id` parameter.
+
+    Plain Core rather than ORM bulk-by-primary-key, which raises
+    StaleDataError when a row was deleted in the meantime.
+    """
+    table = model.__table__
+    return update(table).where(table.c.id == bindparam("row_id")).values(**values)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -22,6 +32,10 @@ class User(Base):
 
 class Identity(Base):
     __tablename__ = "identities"
+    __table_args__ = (
+        # Listing and ownership checks: WHERE user_id = ? [AND id = ?]
+        Index("ix_identities_user_id_id", "user_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -39,6 +53,9 @@ class Identity(Base):
 
 class Skill(Base):
     __tablename__ = "skills"
+    __table_args__ = (
+        Index("ix_skills_identity_id_id", "identity_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     identity_id = Column(Integer, ForeignKey("identities.id"))
@@ -56,6 +73,13 @@ class Skill(Base):
 
 class Habit(Base):
     __tablename__ = "habits"
+    __table_args__ = (
+        # Coach context orders a user's habits by streak
+        Index("ix_habits_user_id_streak", "user_id", "streak"),
+        Index("ix_habits_skill_id", "skill_id"),
+        # "What is due / at risk today" without scanning completion history
+        Index("ix_habits_user_id_streak_status", "user_id", "streak_status"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -63,6 +87,8 @@ class Habit(Base):
     name = Column(String)
     streak = Column(Integer, default=0)
     last_completed = Column(DateTime, nullable=True)
+    # "done", "at_risk" or "due"; set on completion and refreshed daily by app.streaks
+    streak_status = Column(String(16), nullable=False, default="due", server_default="due")
     exp_reward = Column(Integer, default=10)
     chrono_reward = Column(Integer, default=1)
     x = Column(Integer, default=0)
@@ -72,8 +98,32 @@ class Habit(Base):
     user = relationship("User", back_populates="habits")
     skill = relationship("Skill", back_populates="habits")
 
+class HabitCompletion(Base):
+    __tablename__ = "habit_completions"
+    __table_args__ = (
+        Index("ix_habit_completions_habit_id_completed_at", "habit_id", "completed_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    habit_id = Column(Integer, ForeignKey("habits.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    completed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class MaintenanceRun(Base):
+    """Last day a scheduled job ran, so only one worker runs it per day"""
+    __tablename__ = "maintenance_runs"
+
+    job = Column(String(64), primary_key=True)
+    run_on = Column(Date, nullable=False)
+
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        # Pending tasks, most recent first: WHERE user_id = ? AND completed = ? ORDER BY id DESC
+        Index("ix_tasks_user_id_completed_id", "user_id", "completed", "id"),
+        Index("ix_tasks_skill_id", "skill_id"),
+        Index("ix_tasks_identity_id", "identity_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -100,3 +150,19 @@ class Reward(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="rewards")
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_id_key"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    key = Column(String(255), nullable=False)
+    # The request the key was first used for; a replay must match it
+    method = Column(String(10))
+    path = Column(String(255))
+    body_hash = Column(String(64))
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
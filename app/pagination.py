@@ -0,0 +1,71 @@
+from typing import Iterable, Optional, Type
+from fastapi import HTTPException, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .position_buffer import position_buffer
+
+MAX_PAGE_SIZE = 500
+
+
+def parse_fields(fields: Optional[str], schema: Type[BaseModel]) -> Optional[list]:
+    """Validate a `fields=a,b,c` projection against the response schema; `id` is always included"""
+    if not fields:
+        return None
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = sorted(set(requested) - set(schema.model_fields))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ["id"] + [name for name in dict.fromkeys(requested) if name != "id"]
+
+
+async def fetch_page(
+    db: AsyncSession,
+    model,
+    filters: Iterable,
+    response: Response,
+    schema: Type[BaseModel],
+    limit: int,
+    after: Optional[int] = None,
+    fields: Optional[str] = None,
+    position_type: Optional[str] = None,
+):
+    """Keyset page ordered by id.
+
+    Returns at most `limit` rows with id > `after`; when more exist the id to
+    pass as the next `after` is sent in the X-Next-Cursor header. With
+    `fields`, only those columns are selected and plain dicts are returned,
+    bypassing the full response model.
+    """
+    columns = parse_fields(fields, schema)
+    query = select(*(getattr(model, name) for name in columns)) if columns else select(model)
+    query = query.where(*filters)
+    if after is not None:
+        query = query.where(model.id > after)
+    query = query.order_by(model.id).limit(limit + 1)
+
+    if columns:
+        rows = [dict(row._mapping) for row in (await db.execute(query)).all()]
+    else:
+        rows = list((await db.scalars(query)).all())
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        headers["X-Next-Cursor"] = str(last["id"] if columns else last.id)
+
+    if position_type is not None:
+        if columns:
+            for row in rows:
+                pending = position_buffer.pending(position_type, row["id"])
+                if pending is not None:
+                    row.update((axis, value) for axis, value in zip(("x", "y"), pending) if axis in row)
+        else:
+            position_buffer.overlay(position_type, rows)
+
+    if columns:
+        return JSONResponse(rows, headers=headers)
+    response.headers.update(headers)
+    return rows
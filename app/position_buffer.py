@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import bindparam
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from . import models
+from .config import settings
+from .database import session_scope
+
+logger = logging.getLogger(__name__)
+
+TABLES = {
+    "identities": models.Identity,
+    "skills": models.Skill,
+    "habits": models.Habit,
+}
+
+
+def position_update_statement(model):
+    """executemany-able UPDATE of x/y, rows are {"row_id", "x", "y"}"""
+    return models.update_by_id(model, x=bindparam("x"), y=bindparam("y"))
+
+
+class PositionBuffer:
+    """Coalesces canvas position writes.
+
+    Drags send a PATCH per mouse move; only the latest x/y per item is kept
+    and everything pending is written in one transaction every
+    `flush_interval` seconds, and once more on shutdown. Pending positions,
+    and those of a flush still in flight, are overlaid on reads in the same
+    process so users see their own moves before the flush lands.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[str, int], Tuple[float, float]] = {}
+        self._flushing: Dict[Tuple[str, int], Tuple[float, float]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def put(self, type_name: str, item_id: int, x: float, y: float):
+        self._pending[(type_name, item_id)] = (x, y)
+
+    def discard(self, keys: Iterable[Tuple[str, int]]):
+        """Forget pending and in-flight moves that a direct write has superseded"""
+        for key in keys:
+            self._pending.pop(key, None)
+            # Keeps a failed flush from re-queuing the older position
+            self._flushing.pop(key, None)
+
+    def pending(self, type_name: str, item_id: int) -> Optional[Tuple[float, float]]:
+        key = (type_name, item_id)
+        return self._pending.get(key) or self._flushing.get(key)
+
+    def overlay(self, type_name: str, items: Iterable):
+        """Show pending positions on loaded rows without marking them dirty"""
+        if not self._pending and not self._flushing:
+            return
+        for item in items:
+            position = self.pending(type_name, item.id)
+            if position is not None:
+                set_committed_value(item, "x", position[0])
+                set_committed_value(item, "y", position[1])
+
+    async def _write(self, positions: Dict[Tuple[str, int], Tuple[float, float]]):
+        rows_by_type = defaultdict(list)
+        for (type_name, item_id), (x, y) in positions.items():
+            rows_by_type[type_name].append({"row_id": item_id, "x": x, "y": y})
+        async with session_scope() as db:
+            for type_name, rows in rows_by_type.items():
+                await db.execute(position_update_statement(TABLES[type_name]), rows)
+            await db.commit()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        # Reads keep seeing the snapshot through pending() until the write commits
+        self._flushing, self._pending = self._pending, {}
+        try:
+            try:
+                await self._write(self._flushing)
+            except (DataError, IntegrityError):
+                logger.exception("Position flush rejected, retrying %d positions one by one", len(self._flushing))
+                await self._write_one_by_one()
+            except Exception:
+                logger.exception("Position flush failed, keeping %d positions for the next attempt", len(self._flushing))
+                self._requeue()
+        finally:
+            self._flushing = {}
+
+    async def _write_one_by_one(self):
+        """Drop the rows the database rejects, so one bad value can't block the rest"""
+        for key in list(self._flushing):
+            position = self._flushing.get(key)
+            if position is None:
+                continue  # superseded by a direct write meanwhile
+            try:
+                await self._write({key: position})
+            except (DataError, IntegrityError):
+                logger.exception("Dropping position %s for %s:%s", position, *key)
+            except Exception:
+                logger.exception("Position flush failed, keeping the remaining positions for the next attempt")
+                self._requeue()
+                return
+            self._flushing.pop(key, None)
+
+    def _requeue(self):
+        # Newer moves that arrived during the failed flush take precedence;
+        # discard() has already removed moves superseded by direct writes
+        for key, position in self._flushing.items():
+            self._pending.setdefault(key, position)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+
+position_buffer = PositionBuffer(flush_interval=settings.POSITION_FLUSH_INTERVAL_MS / 1000)
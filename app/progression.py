@@ -0,0 +1,131 @@
+"""Levels for users, identities and skills.
+
+Identities and skills are stored the way their level-up endpoints always
+left them: `exp` is the progress inside the current level. Users keep
+`exp` as the running total they always had, and `level` is derived from it.
+Reaching level L takes `base * (L - 1) ** exponent` exp in total, so with
+the defaults (100, 1.0) every level costs 100 exp, as before.
+
+Run this once after deploying, to set user levels for existing exp, and
+after changing the curve, to rebuild every row:
+
+    python -m app.progression --previous-base 100 --previous-exponent 1.0
+"""
+import argparse
+import asyncio
+import math
+from typing import Iterable, Optional, Tuple
+from sqlalchemy import bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .config import settings
+from .database import session_scope
+
+
+class LevelCurve:
+    def __init__(self, base: int, exponent: float):
+        # Sub-linear curves would make later levels cheaper and the float inverse unreliable
+        if base <= 0 or exponent < 1:
+            raise ValueError("Level curve needs base > 0 and exponent >= 1")
+        self.base = base
+        self.exponent = exponent
+
+    def threshold(self, level: int) -> int:
+        """Total exp needed to reach `level`"""
+        return math.ceil(self.base * (level - 1) ** self.exponent)
+
+    def level_for(self, total_exp: int) -> int:
+        """The level a total amount of exp reaches, without iterating over levels"""
+        if total_exp <= 0:
+            return 1
+        level = int((total_exp / self.base) ** (1 / self.exponent)) + 1
+        # Correct float rounding at exact boundaries
+        if self.threshold(level + 1) <= total_exp:
+            level += 1
+        elif self.threshold(level) > total_exp:
+            level -= 1
+        return max(level, 1)
+
+    def normalize(self, level: Optional[int], exp: Optional[int], previous: Optional["LevelCurve"] = None) -> Tuple[int, int]:
+        """(level, exp inside that level) for a stored pair, which may have been written under `previous`"""
+        level = level or 1
+        total = (previous or self).threshold(level) + (exp or 0)
+        new_level = self.level_for(total)
+        return new_level, total - self.threshold(new_level)
+
+
+curve = LevelCurve(settings.LEVEL_CURVE_BASE, settings.LEVEL_CURVE_EXPONENT)
+
+LEVELED_MODELS = (models.User, models.Identity, models.Skill)
+
+
+# Users never had a level-up endpoint, so their exp has always been the running total
+CUMULATIVE_MODELS = (models.User,)
+
+
+def normalized(model, level: Optional[int], exp: Optional[int], previous: Optional[LevelCurve] = None) -> Tuple[int, Optional[int]]:
+    """(level, exp) to store for a row of `model`"""
+    if model in CUMULATIVE_MODELS:
+        return curve.level_for(exp or 0), exp
+    return curve.normalize(level, exp, previous)
+
+
+async def apply_levels(db: AsyncSession, model, rows: Iterable, previous: Optional[LevelCurve] = None) -> int:
+    """Store normalized levels for (id, level, exp) rows that need them; returns how many changed"""
+    changed = []
+    for row_id, level, exp in rows:
+        new_level, new_exp = normalized(model, level, exp, previous)
+        if (new_level, new_exp) != (level, exp):
+            changed.append({"row_id": row_id, "level": new_level, "exp": new_exp})
+    if changed:
+        await db.execute(models.update_by_id(model, level=bindparam("level"), exp=bindparam("exp")), changed)
+    return len(changed)
+
+
+async def settle_levels(db: AsyncSession, model, ids: Iterable[int]) -> int:
+    """Level up rows whose exp was just incremented, in the caller's transaction.
+
+    The increment already holds the row locks, so writing absolute values here
+    cannot race with another award.
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    rows = (await db.execute(select(model.id, model.level, model.exp).where(model.id.in_(ids)))).all()
+    return await apply_levels(db, model, rows)
+
+
+async def recompute_levels(previous: Optional[LevelCurve] = None, batch_size: int = 1000) -> dict:
+    """Rebuild level/exp for every user, identity and skill, one keyset batch per transaction"""
+    changed = {}
+    for model in LEVELED_MODELS:
+        changed[model.__tablename__] = 0
+        after = 0
+        while True:
+            async with session_scope() as db:
+                rows = (await db.execute(
+                    select(model.id, model.level, model.exp).where(model.id > after).order_by(model.id).limit(batch_size)
+                )).all()
+                if not rows:
+                    break
+                changed[model.__tablename__] += await apply_levels(db, model, rows, previous)
+                await db.commit()
+            after = rows[-1][0]
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute stored levels with the configured level curve")
+    parser.add_argument("--previous-base", type=int, help="LEVEL_CURVE_BASE the stored levels were computed with")
+    parser.add_argument("--previous-exponent", type=float, help="LEVEL_CURVE_EXPONENT the stored levels were computed with")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    previous = None
+    if args.previous_base is not None or args.previous_exponent is not None:
+        previous = LevelCurve(args.previous_base or curve.base, args.previous_exponent or curve.exponent)
+    print(asyncio.run(recompute_levels(previous, args.batch_size)))
+
+
+if __name__ == "__main__":
+    main()
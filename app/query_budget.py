@@ -0,0 +1,91 @@
+"""Opt-in per-request SQL budgets, for development and tests.
+
+    @app.get("/dashboard")
+    @query_budget(6)
+    async def read_dashboard(...): ...
+
+With QUERY_BUDGET_MODE=log a request that runs more statements than its
+route allows, or repeats one statement shape N_PLUS_ONE_THRESHOLD times
+(the usual sign of a lazy load or a query in a loop), is logged with the
+offending statement fingerprints. With QUERY_BUDGET_MODE=raise the response
+is held back and the request fails with QueryBudgetExceeded instead, which
+the test client re-raises. Off by default; costs nothing in production.
+"""
+import logging
+from collections import Counter
+from typing import Optional
+from .config import settings
+from .instrumentation import current_query_stats
+
+logger = logging.getLogger(__name__)
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def query_budget(max_queries: int):
+    """Declare how many SQL statements one request to this route may run"""
+    def decorator(endpoint):
+        endpoint.__query_budget__ = max_queries
+        return endpoint
+    return decorator
+
+
+def _budget_for(scope) -> Optional[int]:
+    endpoint = getattr(scope.get("route"), "endpoint", None)
+    return getattr(endpoint, "__query_budget__", settings.QUERY_BUDGET_DEFAULT)
+
+
+def check(scope, stats) -> Optional[str]:
+    """Describe what the request did wrong, or None"""
+    problems = []
+    budget = _budget_for(scope)
+    if budget is not None and stats.count > budget:
+        problems.append(f"{stats.count} queries, budget {budget}")
+    repeated = [
+        (shape, times) for shape, times in stats.statements.most_common()
+        if times >= settings.N_PLUS_ONE_THRESHOLD
+    ]
+    for shape, times in repeated:
+        problems.append(f"possible N+1, {times}x: {shape[:300]}")
+    if not problems:
+        return None
+    route = getattr(scope.get("route"), "path", scope.get("path"))
+    return f"{scope['method']} {route}: " + "; ".join(problems)
+
+
+class QueryBudgetMiddleware:
+    """Must sit inside RequestMetricsMiddleware, which owns the per-request QueryStats"""
+
+    def __init__(self, app, mode: str):
+        self.app = app
+        self.mode = mode
+
+    async def __call__(self, scope, receive, send):
+        stats = current_query_stats()
+        if scope["type"] != "http" or stats is None:
+            await self.app(scope, receive, send)
+            return
+        stats.statements = Counter()
+
+        if self.mode == "log":
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                problem = check(scope, stats)
+                if problem:
+                    logger.warning("Query budget: %s", problem)
+            return
+
+        # raise: hold the response until the statement count is known
+        messages = []
+
+        async def buffer(message):
+            messages.append(message)
+
+        await self.app(scope, receive, buffer)
+        problem = check(scope, stats)
+        if problem:
+            raise QueryBudgetExceeded(problem)
+        for message in messages:
+            await send(message)
@@ -0,0 +1,149 @@
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import bindparam, case, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, progression, streaks
+
+# Rewards are applied as `SET exp = exp + :n` in the database, so concurrent
+# completions (double taps, several devices) can never lose an increment and
+# no row has to be read back first.
+
+TASK_REWARD_COLUMNS = (models.Task.id, models.Task.exp_reward, models.Task.chrono_reward, models.Task.skill_id, models.Task.identity_id)
+HABIT_REWARD_COLUMNS = (models.Habit.id, models.Habit.streak, models.Habit.exp_reward, models.Habit.chrono_reward, models.Habit.skill_id)
+
+async def award(db: AsyncSession, user_id: int, rows: Iterable):
+    """Award completed rows (exp_reward, chrono_reward, skill_id[, identity_id]).
+
+    Rewards are summed per user, skill and identity first, so any number of
+    completions costs a fixed number of statements. Levels gained are
+    applied in the same transaction.
+    """
+    exp = chrono = 0
+    skill_exp: Dict[int, int] = Counter()
+    identity_exp: Dict[int, int] = Counter()
+    for row in rows:
+        reward = row.exp_reward or 0
+        exp += reward
+        chrono += row.chrono_reward or 0
+        if row.skill_id:
+            skill_exp[row.skill_id] += reward
+        if getattr(row, "identity_id", None):
+            identity_exp[row.identity_id] += reward
+
+    if exp or chrono:
+        user = (await db.execute(
+            update(models.User)
+            .where(models.User.id == user_id)
+            .values(exp=func.coalesce(models.User.exp, 0) + exp, chrono_points=func.coalesce(models.User.chrono_points, 0) + chrono)
+            .returning(models.User.id, models.User.level, models.User.exp)
+            .execution_options(synchronize_session=False)
+        )).all()
+        await progression.apply_levels(db, models.User, user)
+    for model, deltas in ((models.Skill, skill_exp), (models.Identity, identity_exp)):
+        if deltas:
+            increment = models.update_by_id(model, exp=func.coalesce(model.exp, 0) + bindparam("delta"))
+            await db.execute(increment, [{"row_id": row_id, "delta": delta} for row_id, delta in deltas.items()])
+            await progression.settle_levels(db, model, deltas)
+
+def _complete_habits_statement(where, now: datetime):
+    # The streak continues if the previous completion is still inside the window, otherwise it restarts at 1
+    return (
+        update(models.Habit)
+        .where(*where)
+        .values(
+            streak=case((streaks.lapsed(now), 1), else_=func.coalesce(models.Habit.streak, 0) + 1),
+            last_completed=now,
+            streak_status=streaks.DONE,
+        )
+        .returning(*HABIT_REWARD_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+
+async def _log_completions(db: AsyncSession, user_id: int, rows: Iterable, now: datetime):
+    values = [{"habit_id": row.id, "user_id": user_id, "completed_at": now} for row in rows]
+    if values:
+        await db.execute(insert(models.HabitCompletion), values)
+
+async def complete_task(db: AsyncSession, user_id: int, task_id: int) -> Optional[dict]:
+    """Mark a task completed and award it, once; None if the user has no such task"""
+    # Only the request that flips `completed` gets the row back, so rewards are granted exactly once
+    task = (await db.execute(
+        update(models.Task)
+        .where(models.Task.id == task_id, models.Task.user_id == user_id, models.Task.completed.isnot(True))
+        .values(completed=True)
+        .returning(*TASK_REWARD_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )).first()
+
+    if task is None:
+        exists = await db.scalar(
+            select(models.Task.id).where(models.Task.id == task_id, models.Task.user_id == user_id)
+        )
+        return {"status": "success"} if exists else None
+
+    await award(db, user_id, [task])
+    return {"status": "success"}
+
+async def complete_habit(db: AsyncSession, user_id: int, habit_id: int, now: Optional[datetime] = None) -> Optional[dict]:
+    """Extend or restart the habit's streak and award it; None if the user has no such habit"""
+    now = now or datetime.utcnow()
+    habit = (await db.execute(_complete_habits_statement(
+        [models.Habit.id == habit_id, models.Habit.user_id == user_id], now,
+    ))).first()
+    if habit is None:
+        return None
+
+    await _log_completions(db, user_id, [habit], now)
+    await award(db, user_id, [habit])
+    return {"status": "success", "streak": habit.streak}
+
+async def complete_tasks(db: AsyncSession, user_id: int, task_ids: List[int]) -> List[dict]:
+    """Complete many tasks with one ownership query, one UPDATE and aggregated rewards"""
+    ids = list(dict.fromkeys(task_ids))
+    owned = set((await db.scalars(
+        select(models.Task.id).where(models.Task.id.in_(ids), models.Task.user_id == user_id)
+    )).all())
+
+    completed = {}
+    if owned:
+        rows = (await db.execute(
+            update(models.Task)
+            .where(models.Task.id.in_(owned), models.Task.user_id == user_id, models.Task.completed.isnot(True))
+            .values(completed=True)
+            .returning(*TASK_REWARD_COLUMNS)
+            .execution_options(synchronize_session=False)
+        )).all()
+        completed = {row.id: row for row in rows}
+        await award(db, user_id, rows)
+
+    results = []
+    for task_id in task_ids:
+        if task_id not in owned:
+            results.append({"id": task_id, "success": False, "message": "Task not found"})
+        elif task_id in completed:
+            results.append({"id": task_id, "success": True})
+        else:
+            results.append({"id": task_id, "success": True, "message": "Already completed"})
+    return results
+
+async def complete_habits(db: AsyncSession, user_id: int, habit_ids: List[int], now: Optional[datetime] = None) -> List[dict]:
+    """Complete many habits with a single UPDATE ... RETURNING and aggregated rewards.
+
+    The user_id filter doubles as the ownership check: ids that come back
+    unchanged are not the user's (or do not exist).
+    """
+    now = now or datetime.utcnow()
+    ids = list(dict.fromkeys(habit_ids))
+    rows = (await db.execute(_complete_habits_statement(
+        [models.Habit.id.in_(ids), models.Habit.user_id == user_id], now,
+    ))).all()
+    await _log_completions(db, user_id, rows, now)
+    await award(db, user_id, rows)
+
+    streak_by_id = {row.id: row.streak for row in rows}
+    return [
+        {"id": habit_id, "success": True, "streak": streak_by_id[habit_id]} if habit_id in streak_by_id
+        else {"id": habit_id, "success": False, "message": "Habit not found"}
+        for habit_id in habit_ids
+    ]
@@ -0,0 +1,142 @@
+import json
+from collections import defaultdict
+from typing import Dict, Optional, Set
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+from ..auth import get_current_principal
+from ..database import session_scope
+from ..position_buffer import position_buffer, position_update_statement
+from ..schemas.item_schemas import PositionUpdate, SectionUpdate
+from .items import MODEL_MAP, resolve_owner, verify_ownership
+
+router = APIRouter(tags=["canvas"])
+
+
+class CanvasConnections:
+    """Open canvas sockets per user, so changes fan out to the user's other sessions.
+
+    Connections are tracked per worker process; sessions of the same user on
+    another worker do not receive each other's updates.
+    """
+
+    def __init__(self):
+        self._sockets: Dict[int, Set[WebSocket]] = defaultdict(set)
+
+    def add(self, user_id: int, websocket: WebSocket):
+        self._sockets[user_id].add(websocket)
+
+    def remove(self, user_id: int, websocket: WebSocket):
+        self._sockets[user_id].discard(websocket)
+        if not self._sockets[user_id]:
+            del self._sockets[user_id]
+
+    async def broadcast(self, user_id: int, message: dict, exclude: Optional[WebSocket] = None):
+        for websocket in list(self._sockets.get(user_id, ())):
+            if websocket is exclude:
+                continue
+            try:
+                await websocket.send_json(message)
+            except Exception:
+                self.remove(user_id, websocket)
+
+
+connections = CanvasConnections()
+
+
+async def _receive_json(websocket: WebSocket):
+    """Next text frame parsed as JSON; raises ValueError for binary frames and bad JSON"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("text") is None:
+        raise ValueError("Expected a text frame")
+    return json.loads(message["text"])
+
+
+async def _authenticate(websocket: WebSocket):
+    """Use ?token=... or, failing that, a first {"type": "auth", "token": ...} message"""
+    token = websocket.query_params.get("token")
+    if token is None:
+        try:
+            message = await _receive_json(websocket)
+        except ValueError:
+            return None
+        if not isinstance(message, dict) or message.get("type") != "auth":
+            return None
+        token = message.get("token")
+    if not isinstance(token, str) or not token:
+        return None
+    try:
+        async with session_scope() as db:
+            return await get_current_principal(token=token, db=db)
+    except HTTPException:
+        return None
+
+
+async def _apply(message: dict, principal) -> dict:
+    """Apply one update with the same ownership rules as the /items endpoints"""
+    async with session_scope() as db:
+        type_name, item_id, owner_id = await resolve_owner(message.get("item"), db)
+        verify_ownership(owner_id, principal)
+
+        if message["type"] == "position":
+            position = PositionUpdate(x=message.get("x"), y=message.get("y"))
+            if position_buffer.running:
+                position_buffer.put(type_name, item_id, position.x, position.y)
+            else:
+                await db.execute(position_update_statement(MODEL_MAP[type_name]), [{"row_id": item_id, "x": position.x, "y": position.y}])
+                await db.commit()
+            return {"type": "position", "item": f"{type_name}:{item_id}", "x": position.x, "y": position.y}
+
+        update = SectionUpdate(new_section=message.get("new_section"), position=message.get("position"))
+        if MODEL_MAP[update.new_section] is not MODEL_MAP[type_name]:
+            raise HTTPException(status_code=400, detail="Cannot change item type")
+        return {"type": "section", "item": f"{type_name}:{item_id}", "new_section": update.new_section, "position": update.position}
+
+
+@router.websocket("/ws/canvas")
+async def canvas_socket(websocket: WebSocket):
+    """Live canvas editing.
+
+    Client -> server:
+        {"type": "position", "item": "skills:3", "x": 10, "y": 20, "seq": 1}
+        {"type": "section", "item": "skills:3", "new_section": "skills", "position": 2, "seq": 2}
+    Server -> client:
+        {"type": "ack", "seq": 1, "success": true} or {"type": "ack", "seq": 1, "success": false, "detail": ...}
+        and the applied change, echoed to the user's other open sessions.
+    """
+    await websocket.accept()
+    try:
+        principal = await _authenticate(websocket)
+    except WebSocketDisconnect:
+        return
+    if principal is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Could not validate credentials")
+        return
+
+    connections.add(principal.id, websocket)
+    try:
+        while True:
+            try:
+                message = await _receive_json(websocket)
+            except ValueError:
+                await websocket.send_json({"type": "ack", "seq": None, "success": False, "detail": "Invalid JSON text frame"})
+                continue
+            seq = message.get("seq") if isinstance(message, dict) else None
+            if not isinstance(message, dict) or message.get("type") not in ("position", "section"):
+                await websocket.send_json({"type": "ack", "seq": seq, "success": False, "detail": "Unknown message type"})
+                continue
+            try:
+                change = await _apply(message, principal)
+            except HTTPException as e:
+                await websocket.send_json({"type": "ack", "seq": seq, "success": False, "detail": e.detail})
+                continue
+            except ValidationError as e:
+                await websocket.send_json({"type": "ack", "seq": seq, "success": False, "detail": e.errors(include_url=False, include_context=False)})
+                continue
+            await websocket.send_json({"type": "ack", "seq": seq, "success": True, "item": change["item"]})
+            await connections.broadcast(principal.id, change, exclude=websocket)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        connections.remove(principal.id, websocket)
@@ -1,10 +1,14 @@
+from collections import defaultdict
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Union
+from sqlalchemy import literal, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 from ..database import get_db
 from ..models import Identity, Skill, Habit
-from ..schemas.item_schemas import PositionUpdate, SectionUpdate, BatchUpdate, ItemResponse
-from ..auth import get_current_user
+from ..position_buffer import position_buffer, position_update_statement
+from ..query_budget import query_budget
+from ..schemas.item_schemas import COORDINATE_LIMIT, PositionUpdate, SectionUpdate, BatchUpdate, ItemResponse
+from ..auth import get_current_principal
 
 router = APIRouter(prefix="/items", tags=["items"])
 
@@ -14,87 +18,243 @@ MODEL_MAP = {
     "habits": Habit
 }
 
-def get_item_model(item_id: int, db: Session):
-    """Get the correct model instance based on item_id"""
-    for model in MODEL_MAP.values():
-        item = db.query(model).filter(model.id == item_id).first()
-        if item:
-            return item, model
+ItemKey = Tuple[str, int]
+
+def parse_item_ref(ref: Union[int, str]) -> Tuple[Optional[str], int]:
+    """Split a typed reference like "skills:12" into ("skills", 12).
+
+    Bare ids are still accepted for older clients and come back with a None
+    type; resolve_untyped_ids works out which table they live in.
+    """
+    if isinstance(ref, int):
+        return None, ref
+    if not isinstance(ref, str):
+        raise HTTPException(status_code=400, detail="Invalid item reference")
+    type_name, sep, raw_id = ref.partition(":")
+    if not sep:
+        type_name, raw_id = None, ref
+    elif type_name not in MODEL_MAP:
+        raise HTTPException(status_code=400, detail=f"Unknown item type '{type_name}'")
+    try:
+        return type_name, int(raw_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid item reference '{ref}'")
+
+async def resolve_untyped_ids(item_ids: Iterable[int], db: AsyncSession) -> Dict[int, str]:
+    """Find the table for legacy bare ids with one UNION ALL query.
+
+    Ids are not unique across tables; identities win over skills over habits,
+    matching the old probing order.
+    """
+    item_ids = list(set(item_ids))
+    if not item_ids:
+        return {}
+    query = union_all(*(
+        select(literal(type_name).label("type"), model.id.label("id")).where(model.id.in_(item_ids))
+        for type_name, model in MODEL_MAP.items()
+    ))
+    found = defaultdict(set)
+    for row in (await db.execute(query)).all():
+        found[row.id].add(row.type)
+    return {
+        item_id: next(type_name for type_name in MODEL_MAP if type_name in types)
+        for item_id, types in found.items()
+    }
+
+async def load_items(keys: Iterable[ItemKey], db: AsyncSession) -> Dict[ItemKey, Tuple[object, Optional[int]]]:
+    """Load items with one IN (...) query per type, returning {key: (item, owner user_id)}"""
+    ids_by_type = defaultdict(set)
+    for type_name, item_id in keys:
+        ids_by_type[type_name].add(item_id)
+
+    loaded = {}
+    for type_name, ids in ids_by_type.items():
+        model = MODEL_MAP[type_name]
+        if model is Skill:
+            # Skills are owned through their identity
+            query = select(Skill, Identity.user_id).outerjoin(Identity, Skill.identity_id == Identity.id)
+        else:
+            query = select(model, model.user_id)
+        for item, owner_id in (await db.execute(query.where(model.id.in_(ids)))).all():
+            loaded[(type_name, item.id)] = (item, owner_id)
+    return loaded
+
+async def get_item_model(item_ref: Union[int, str], db: AsyncSession):
+    """Get the item, its model and its owner's user id from a typed or bare reference"""
+    type_name, item_id = parse_item_ref(item_ref)
+    if type_name is None:
+        type_name = (await resolve_untyped_ids([item_id], db)).get(item_id)
+    if type_name is not None:
+        loaded = await load_items([(type_name, item_id)], db)
+        if (type_name, item_id) in loaded:
+            item, owner_id = loaded[(type_name, item_id)]
+            return item, MODEL_MAP[type_name], owner_id
     raise HTTPException(status_code=404, detail="Item not found")
 
-@router.patch("/{item_id}/position", response_model=ItemResponse)
+def verify_ownership(owner_id: Optional[int], current_user):
+    if owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to update this item")
+
+async def fetch_owners(
+    keys: Iterable[ItemKey], untyped_ids: Iterable[int], db: AsyncSession
+) -> Tuple[Dict[ItemKey, Optional[int]], Dict[int, str]]:
+    """Resolve owner user ids for a whole batch in one UNION ALL query.
+
+    `keys` are typed (type, id) pairs; `untyped_ids` are legacy bare ids,
+    which are looked up in every table and resolved with the usual
+    identities > skills > habits precedence. Returns
+    ({(type, id): owner user_id}, {bare id: type}).
+    """
+    untyped_ids = set(untyped_ids)
+    ids_by_type = defaultdict(set)
+    for type_name, item_id in keys:
+        ids_by_type[type_name].add(item_id)
+
+    selects = []
+    for type_name, model in MODEL_MAP.items():
+        ids = ids_by_type[type_name] | untyped_ids
+        if not ids:
+            continue
+        if model is Skill:
+            query = select(literal(type_name).label("type"), Skill.id.label("id"), Identity.user_id.label("owner_id")) \
+                .outerjoin(Identity, Skill.identity_id == Identity.id)
+        else:
+            query = select(literal(type_name).label("type"), model.id.label("id"), model.user_id.label("owner_id"))
+        selects.append(query.where(model.id.in_(ids)))
+    if not selects:
+        return {}, {}
+
+    owners = {}
+    for row in (await db.execute(union_all(*selects))).all():
+        owners[(row.type, row.id)] = row.owner_id
+    untyped_types = {}
+    for item_id in untyped_ids:
+        type_name = next((t for t in MODEL_MAP if (t, item_id) in owners), None)
+        if type_name is not None:
+            untyped_types[item_id] = type_name
+    return owners, untyped_types
+
+async def resolve_owner(item_ref: Union[int, str], db: AsyncSession) -> Tuple[str, int, Optional[int]]:
+    """(type, id, owner user_id) for a reference, in one query.
+
+    Not cached: SQLite reuses deleted ids, so a cached owner could authorize
+    moves on another user's new item.
+    """
+    type_name, item_id = parse_item_ref(item_ref)
+    if type_name is None:
+        owners, untyped_types = await fetch_owners([], [item_id], db)
+        type_name = untyped_types.get(item_id)
+    else:
+        owners, _ = await fetch_owners([(type_name, item_id)], [], db)
+    if (type_name, item_id) not in owners:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return type_name, item_id, owners[(type_name, item_id)]
+
+@router.patch("/{item_ref}/position", response_model=ItemResponse)
+@query_budget(3)
 async def update_position(
-    item_id: int,
+    item_ref: str,
     position: PositionUpdate,
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_current_principal)
 ):
-    item, _ = get_item_model(item_id, db)
-    
+    type_name, item_id, owner_id = await resolve_owner(item_ref, db)
+
     # Verify ownership
-    if hasattr(item, "user_id") and item.user_id != current_user.id:
-        if hasattr(item, "identity") and item.identity.user_id != current_user.id:
-            raise HTTPException(status_code=403, detail="Not authorized to update this item")
-    
-    # Update position
-    item.x = position.x
-    item.y = position.y
-    db.commit()
-    
-    return {"id": item_id, "success": True}
-
-@router.patch("/{item_id}/section", response_model=ItemResponse)
+    verify_ownership(owner_id, current_user)
+
+    # Drags are coalesced and flushed in the background; write through otherwise
+    if position_buffer.running:
+        position_buffer.put(type_name, item_id, position.x, position.y)
+    else:
+        await db.execute(position_update_statement(MODEL_MAP[type_name]), [{"row_id": item_id, "x": position.x, "y": position.y}])
+        await db.commit()
+
+    return {"id": item_id, "type": type_name, "success": True}
+
+@router.patch("/{item_ref}/section", response_model=ItemResponse)
+@query_budget(5)
 async def update_section(
-    item_id: int,
+    item_ref: str,
     update: SectionUpdate,
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_current_principal)
 ):
-    item, source_model = get_item_model(item_id, db)
+    item, source_model, owner_id = await get_item_model(item_ref, db)
     target_model = MODEL_MAP[update.new_section]
-    
+
     # Verify ownership
-    if hasattr(item, "user_id") and item.user_id != current_user.id:
-        if hasattr(item, "identity") and item.identity.user_id != current_user.id:
-            raise HTTPException(status_code=403, detail="Not authorized to update this item")
-    
+    verify_ownership(owner_id, current_user)
+
     # Update section and position
     if source_model != target_model:
         raise HTTPException(status_code=400, detail="Cannot change item type")
-    
+
     # Update position within section
     item.position = update.position
-    db.commit()
-    
-    return {"id": item_id, "success": True}
+    await db.commit()
+
+    return {"id": item.id, "type": source_model.__tablename__, "success": True}
 
 @router.post("/batch", response_model=List[ItemResponse])
+@query_budget(6)
 async def batch_update(
     updates: BatchUpdate,
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_current_principal)
 ):
+    """Apply a canvas batch with a constant number of statements.
+
+    One query checks types and ownership for every item, then each table
+    gets a single executemany UPDATE keyed by primary key.
+    """
+    refs = []
+    for item_ref in updates.item_ids:
+        try:
+            refs.append(parse_item_ref(item_ref))
+        except HTTPException as e:
+            refs.append(e)
+    parsed = [ref for ref in refs if isinstance(ref, tuple)]
+    owners, untyped_types = await fetch_owners(
+        [ref for ref in parsed if ref[0] is not None],
+        [ref[1] for ref in parsed if ref[0] is None],
+        db,
+    )
+
     responses = []
-    
-    for item_id, update in zip(updates.item_ids, updates.updates):
+    rows_by_type = defaultdict(dict)
+
+    for ref, update in zip(refs, updates.updates):
+        type_name, item_id = ref if isinstance(ref, tuple) else (None, None)
         try:
-            item, _ = get_item_model(item_id, db)
-            
+            if isinstance(ref, HTTPException):
+                raise ref
+            if type_name is None:
+                type_name = untyped_types.get(item_id)
+            if (type_name, item_id) not in owners:
+                raise HTTPException(status_code=404, detail="Item not found")
+
             # Verify ownership
-            if hasattr(item, "user_id") and item.user_id != current_user.id:
-                if hasattr(item, "identity") and item.identity.user_id != current_user.id:
-                    raise HTTPException(status_code=403, detail="Not authorized to update this item")
-            
-            # Apply updates
+            verify_ownership(owners[(type_name, item_id)], current_user)
+
+            # Collect updates; the last one wins if an item appears twice
             if "x" in update and "y" in update:
-                item.x = update["x"]
-                item.y = update["y"]
+                if not all(isinstance(update[k], (int, float)) for k in ("x", "y")):
+                    raise HTTPException(status_code=400, detail="Coordinates must be numbers")
+                if not all(-COORDINATE_LIMIT <= update[k] <= COORDINATE_LIMIT for k in ("x", "y")):
+                    raise HTTPException(status_code=400, detail="Coordinates out of range")
+                rows_by_type[type_name][item_id] = {"row_id": item_id, "x": update["x"], "y": update["y"]}
             elif "new_section" in update and "position" in update:
-                item.position = update["position"]
-            
-            responses.append({"id": item_id, "success": True})
+                # Items have no stored order within a section; accepted for compatibility
+                pass
+
+            responses.append({"id": item_id, "type": type_name, "success": True})
         except Exception as e:
-            responses.append({"id": item_id, "success": False, "message": str(e)})
-    
-    db.commit()
+            responses.append({"id": item_id, "type": type_name, "success": False, "message": str(e)})
+
+    for type_name, rows in rows_by_type.items():
+        await db.execute(position_update_statement(MODEL_MAP[type_name]), list(rows.values()))
+        # Older buffered drags must not overwrite this write when they flush
+        position_buffer.discard((type_name, item_id) for item_id in rows)
+    await db.commit()
     return responses
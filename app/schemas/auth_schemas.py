@@ -6,6 +6,12 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: str | None = None
+    user_id: int | None = None
+
+class Principal(BaseModel):
+    """Lightweight snapshot of the authenticated user"""
+    id: int
+    username: str | None = None
 
 class UserBase(BaseModel):
     username: str
@@ -50,6 +50,7 @@ class Habit(HabitBase):
     id: int
     user_id: int
     streak: int = 0
+    streak_status: str = "due"
     x: int = 0
     y: int = 0
 
@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+from typing import List
+from .auth_schemas import User
+from .core_schemas import Habit, Identity, Skill
+from .task_schemas import Task
+
+class DashboardSkill(Skill):
+    habits: List[Habit] = []
+
+class DashboardIdentity(Identity):
+    skills: List[DashboardSkill] = []
+
+class Dashboard(BaseModel):
+    user: User
+    identities: List[DashboardIdentity]
+    habits: List[Habit]  # Habits not attached to a skill
+    pending_tasks: List[Task]
@@ -1,19 +1,23 @@
-from pydantic import BaseModel
-from typing import List, Literal
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional, Union
+
+# x/y are Integer (int4) columns; one out-of-range value fails a whole flush
+COORDINATE_LIMIT = 1_000_000_000
 
 class PositionUpdate(BaseModel):
-    x: float
-    y: float
+    x: float = Field(..., ge=-COORDINATE_LIMIT, le=COORDINATE_LIMIT)
+    y: float = Field(..., ge=-COORDINATE_LIMIT, le=COORDINATE_LIMIT)
 
 class SectionUpdate(BaseModel):
     new_section: Literal["identities", "skills", "habits"]
     position: int  # Order within section
 
 class BatchUpdate(BaseModel):
-    item_ids: List[int]
+    item_ids: List[Union[int, str]]  # "identities:12" style references, bare ids still accepted
     updates: List[dict]  # List of position or section updates
 
 class ItemResponse(BaseModel):
-    id: int
+    id: Optional[int] = None
+    type: Optional[str] = None
     success: bool
     message: str = "Update successful"
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 class TaskBase(BaseModel):
     title: str
@@ -33,3 +33,12 @@ class Reward(RewardBase):
 
     class Config:
         from_attributes = True
+
+class BulkComplete(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=500)
+
+class CompletionResult(BaseModel):
+    id: int
+    success: bool
+    streak: Optional[int] = None
+    message: Optional[str] = None
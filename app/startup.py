@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from sqlalchemy import inspect, text
+from fastapi.concurrency import run_in_threadpool
+from . import models, metrics
+from .config import settings
+from .database import async_engine, engine
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+
+
+def configure_logging():
+    """Give the `app` loggers a handler; uvicorn's logging config only covers its own loggers"""
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(settings.LOG_LEVEL.upper())
+    # Leave it to the root logger when something (gunicorn, pytest) has configured one
+    if not app_logger.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(levelname)s:     %(name)s - %(message)s"))
+        app_logger.addHandler(handler)
+
+
+class StartupTimer:
+    """Times startup phases for the log line and the app_startup_phase_seconds gauge"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+            metrics.STARTUP_PHASE_SECONDS.labels(name).set(self.phases[name])
+
+    def log(self):
+        total = time.perf_counter() - self.started
+        metrics.STARTUP_PHASE_SECONDS.labels("total").set(total)
+        logger.info(
+            "Startup finished in %.0f ms (%s)",
+            total * 1000,
+            ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.phases.items()),
+        )
+
+
+def _alembic_heads():
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option("script_location", str(ALEMBIC_INI.parent / "alembic"))
+    return set(ScriptDirectory.from_config(config).get_heads())
+
+
+class SchemaOutOfDate(RuntimeError):
+    """The database has Alembic history but is not at head"""
+
+
+def prepare_schema() -> str:
+    """Check the database against the Alembic head before serving.
+
+    A database without an alembic_version table is a fresh dev database and
+    gets its tables from create_all. One that is behind head is refused:
+    create_all would add new tables but not new columns, and the tables it
+    created would then break `alembic upgrade head`.
+
+    Blocking; run it in the threadpool. Returns what was done, for the log.
+    """
+    if not settings.AUTO_CREATE_SCHEMA:
+        return "disabled"
+    try:
+        with engine.connect() as conn:
+            if inspect(conn).has_table("alembic_version"):
+                from alembic.runtime.migration import MigrationContext
+
+                current = set(MigrationContext.configure(conn).get_current_heads())
+                heads = _alembic_heads()
+                if current != heads:
+                    raise SchemaOutOfDate(
+                        f"Database revision {sorted(current)} is not Alembic head {sorted(heads)}; "
+                        "run `alembic upgrade head` before starting the app"
+                    )
+                return "at_head"
+        models.Base.metadata.create_all(bind=engine)
+        return "create_all"
+    finally:
+        # Requests use the async engine; don't leave this connection idle in the sync pool
+        if async_engine is not None:
+            engine.dispose()
+
+
+async def warm_pool():
+    """Open DB_POOL_WARM_CONNECTIONS connections up front so first requests skip the connect handshake"""
+    count = min(settings.DB_POOL_WARM_CONNECTIONS, settings.DB_POOL_SIZE)
+    if count <= 0:
+        return
+    if async_engine is not None:
+        # Hold every connection until all are open, so each one is a separate pool slot
+        conns = await asyncio.gather(*(async_engine.connect() for _ in range(count)))
+        try:
+            await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in conns))
+        finally:
+            await asyncio.gather(*(conn.close() for conn in conns))
+        return
+
+    def ping_all():
+        conns = []
+        try:
+            for _ in range(count):
+                conns.append(engine.connect())
+                conns[-1].execute(text("SELECT 1"))
+        finally:
+            for conn in conns:
+                conn.close()
+
+    await run_in_threadpool(ping_all)
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Optional
+from sqlalchemy import and_, case, delete, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from . import models
+from .config import settings
+from .database import session_scope
+
+logger = logging.getLogger(__name__)
+
+DONE = "done"          # completed today (UTC)
+AT_RISK = "at_risk"    # has a streak, not completed yet today
+DUE = "due"            # no running streak
+
+# A completion continues the streak when the previous one is less than this old
+STREAK_WINDOW = timedelta(days=2)
+
+
+def lapsed(now: datetime):
+    return or_(models.Habit.last_completed.is_(None), models.Habit.last_completed <= now - STREAK_WINDOW)
+
+
+async def refresh_streaks(now: Optional[datetime] = None, batch_size: Optional[int] = None) -> dict:
+    """Reset lapsed streaks and recompute streak_status for every habit.
+
+    One UPDATE per id range, each in its own transaction, touching only rows
+    whose streak or status actually changes.
+    """
+    now = now or datetime.utcnow()
+    batch_size = batch_size or settings.STREAK_MAINTENANCE_BATCH_SIZE
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # SET expressions all see the pre-update row, so status is derived from `lapsed` rather than the new streak
+    is_lapsed = lapsed(now)
+    new_streak = case((is_lapsed, 0), else_=models.Habit.streak)
+    new_status = case(
+        (models.Habit.last_completed >= day_start, DONE),
+        (and_(~is_lapsed, models.Habit.streak > 0), AT_RISK),
+        else_=DUE,
+    )
+
+    async with session_scope() as db:
+        max_id = await db.scalar(select(func.max(models.Habit.id))) or 0
+
+    updated = 0
+    for start in range(0, max_id, batch_size):
+        async with session_scope() as db:
+            result = await db.execute(
+                update(models.Habit)
+                .where(
+                    models.Habit.id > start,
+                    models.Habit.id <= start + batch_size,
+                    or_(and_(is_lapsed, models.Habit.streak != 0), models.Habit.streak_status != new_status),
+                )
+                .values(streak=new_streak, streak_status=new_status)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            updated += result.rowcount
+    return {"habits_updated": updated}
+
+
+async def purge_idempotency_keys(now: Optional[datetime] = None) -> int:
+    now = now or datetime.utcnow()
+    async with session_scope() as db:
+        result = await db.execute(
+            delete(models.IdempotencyKey)
+            .where(models.IdempotencyKey.created_at < now - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        return result.rowcount
+
+
+async def run_maintenance() -> dict:
+    stats = await refresh_streaks()
+    stats["idempotency_keys_purged"] = await purge_idempotency_keys()
+    return stats
+
+
+async def claim_daily_run(job: str, day: date) -> bool:
+    """Record that `job` runs for `day`; False if another worker already has.
+
+    The conditional UPDATE takes the row lock, so of several workers waking
+    at the same time exactly one sees a row to change.
+    """
+    async with session_scope() as db:
+        result = await db.execute(
+            update(models.MaintenanceRun)
+            .where(models.MaintenanceRun.job == job, models.MaintenanceRun.run_on < day)
+            .values(run_on=day)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            if await db.scalar(select(models.MaintenanceRun.job).where(models.MaintenanceRun.job == job)):
+                await db.rollback()
+                return False
+            db.add(models.MaintenanceRun(job=job, run_on=day))
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            return False
+        return True
+
+
+def last_scheduled_day(hour_utc: int, now: Optional[datetime] = None) -> date:
+    """Day of the most recent `hour_utc` that has passed"""
+    now = now or datetime.utcnow()
+    day = now.date()
+    if now.hour < hour_utc:
+        day -= timedelta(days=1)
+    return day
+
+
+def seconds_until(hour_utc: int, now: Optional[datetime] = None) -> float:
+    now = now or datetime.utcnow()
+    next_run = now.replace(hour=hour_utc, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+class StreakScheduler:
+    """Runs the maintenance job daily at `hour_utc`, on one worker.
+
+    Every worker keeps its own schedule, but a run is claimed in
+    maintenance_runs first, so restarts and extra workers don't repeat it.
+    At startup a worker only runs it if the last scheduled run was missed.
+    A failed run is not retried; the next day's run covers every habit again.
+    """
+
+    JOB = "streak_maintenance"
+
+    def __init__(self, hour_utc: int):
+        self.hour_utc = hour_utc
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            try:
+                if await claim_daily_run(self.JOB, last_scheduled_day(self.hour_utc)):
+                    logger.info("Streak maintenance: %s", await run_maintenance())
+            except Exception:
+                logger.exception("Streak maintenance failed")
+            await asyncio.sleep(seconds_until(self.hour_utc))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+streak_scheduler = StreakScheduler(hour_utc=settings.STREAK_MAINTENANCE_HOUR_UTC)
@@ -0,0 +1,249 @@
+"""Drive the real API in-process and report latency, throughput and SQL per request.
+
+    python -m benchmarks.api_load --users 2000 --concurrency 20 --output run.json
+    python -m benchmarks.api_load --compare baseline.json
+
+Seeds a throwaway SQLite database (or --database-url for a scratch Postgres
+database, which is dropped and recreated) with the same data shape as
+benchmarks.index_plans, starts the app with its lifespan, and sends requests
+through httpx's ASGI transport, so there is no network or server process in
+the numbers. The coach runs against the stub LLM transport (OPENAI_STUB).
+Each scenario runs `--requests` requests with `--concurrency` in flight and
+reports p50/p95/p99 latency, throughput and SQL statements per request as
+JSON. With --compare, the p50/p95/throughput ratios against an earlier
+report are added.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+PASSWORD = "benchmark"
+
+# name -> (route template, as labelled by the metrics middleware)
+SCENARIOS = {
+    "token": "/token",
+    "users_me": "/users/me",
+    "list_identities": "/identities/",
+    "items_batch": "/items/batch",
+    "complete_task": "/tasks/{task_id}/complete",
+    "coach": "/identities/{identity_id}/ai-coach",
+}
+
+
+def configure_environment(url: str):
+    """Settings are read at import time, so this has to run before `app` is imported"""
+    os.environ["DATABASE_URL"] = url
+    os.environ["OPENAI_STUB"] = "true"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    # Every coach request should reach the (stub) model, not the response cache
+    os.environ.setdefault("COACH_CACHE_BACKEND", "none")
+    os.environ.setdefault("STREAK_MAINTENANCE_ENABLED", "false")
+
+
+def seed_database(url: str, args) -> dict:
+    from sqlalchemy import create_engine
+    from app import models
+    from app.auth import pwd_context
+    from benchmarks.index_plans import seed
+
+    engine = create_engine(url)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    sizes = seed(engine, args.users, args.identities, args.skills, args.habits, args.tasks,
+                 password_hash=pwd_context.hash(PASSWORD))
+    engine.dispose()
+    return sizes
+
+
+def load_fixtures(url: str, user_ids: list) -> dict:
+    """Item and task ids of the users that send requests"""
+    from sqlalchemy import create_engine, select
+    from app import models
+
+    engine = create_engine(url)
+    fixtures = {u: {"items": [], "pending_tasks": [], "completed_tasks": [], "identities": []} for u in user_ids}
+    with engine.connect() as conn:
+        for identity_id, user_id in conn.execute(
+            select(models.Identity.id, models.Identity.user_id).where(models.Identity.user_id.in_(user_ids))
+        ):
+            fixtures[user_id]["identities"].append(identity_id)
+            fixtures[user_id]["items"].append(f"identities:{identity_id}")
+        for skill_id, user_id in conn.execute(
+            select(models.Skill.id, models.Identity.user_id).join(models.Identity).where(models.Identity.user_id.in_(user_ids))
+        ):
+            fixtures[user_id]["items"].append(f"skills:{skill_id}")
+        for habit_id, user_id in conn.execute(
+            select(models.Habit.id, models.Habit.user_id).where(models.Habit.user_id.in_(user_ids))
+        ):
+            fixtures[user_id]["items"].append(f"habits:{habit_id}")
+        for task_id, user_id, completed in conn.execute(
+            select(models.Task.id, models.Task.user_id, models.Task.completed).where(models.Task.user_id.in_(user_ids))
+        ):
+            fixtures[user_id]["completed_tasks" if completed else "pending_tasks"].append(task_id)
+    engine.dispose()
+    return fixtures
+
+
+def build_request(name: str, user: dict, rng: random.Random, n: int):
+    """(method, url, kwargs) for one request of a scenario"""
+    headers = {"Authorization": f"Bearer {user['token']}"}
+    if name == "token":
+        return "POST", "/token", {"data": {"username": user["username"], "password": PASSWORD}}
+    if name == "users_me":
+        return "GET", "/users/me", {"headers": headers}
+    if name == "list_identities":
+        return "GET", "/identities/", {"headers": headers}
+    if name == "items_batch":
+        refs = rng.sample(user["items"], min(20, len(user["items"])))
+        updates = [{"x": rng.randint(0, 2000), "y": rng.randint(0, 2000)} for _ in refs]
+        return "POST", "/items/batch", {"headers": headers, "json": {"item_ids": refs, "updates": updates}}
+    if name == "complete_task":
+        # Once a user runs out of pending tasks this measures the already-completed path
+        if user["pending_tasks"]:
+            user["completed_tasks"].append(user["pending_tasks"].pop())
+        task_id = user["completed_tasks"][-1] if user["completed_tasks"] else 0
+        return "POST", f"/tasks/{task_id}/complete", {"headers": headers}
+    if name == "coach":
+        identity_id = rng.choice(user["identities"])
+        return "POST", f"/identities/{identity_id}/ai-coach", {
+            "headers": headers, "json": {"user_input": f"How do I keep going? ({n})"},
+        }
+    raise ValueError(f"Unknown scenario {name}")
+
+
+def _percentile(samples: list, q: float) -> float:
+    return samples[min(len(samples) - 1, int(round(q * (len(samples) - 1))))]
+
+
+def _queries(route: str):
+    from prometheus_client import REGISTRY
+
+    labels = {"route": route}
+    return (REGISTRY.get_sample_value("db_queries_per_request_sum", labels) or 0.0,
+            REGISTRY.get_sample_value("db_queries_per_request_count", labels) or 0.0)
+
+
+async def run_scenario(client, name: str, users: list, requests: int, concurrency: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    latencies, statuses = [], {}
+    queries_before, count_before = _queries(SCENARIOS[name])
+    next_request = 0
+
+    async def worker():
+        nonlocal next_request
+        while next_request < requests:
+            n = next_request
+            next_request += 1
+            method, url, kwargs = build_request(name, users[n % len(users)], rng, n)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    queries_after, count_after = _queries(SCENARIOS[name])
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+        "p50_ms": round(_percentile(latencies, 0.50), 2),
+        "p95_ms": round(_percentile(latencies, 0.95), 2),
+        "p99_ms": round(_percentile(latencies, 0.99), 2),
+        "queries_per_request": round((queries_after - queries_before) / max(count_after - count_before, 1), 2),
+    }
+
+
+async def run(args, sizes: dict) -> dict:
+    import httpx
+    from app.main import app
+
+    rng = random.Random(42)
+    user_ids = rng.sample(range(1, sizes["users"] + 1), min(args.active_users, sizes["users"]))
+    fixtures = load_fixtures(os.environ["DATABASE_URL"], user_ids)
+
+    report = {"rows": sizes, "scenarios": {}}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            users = []
+            for user_id in user_ids:
+                username = f"user{user_id}"
+                response = await client.post("/token", data={"username": username, "password": PASSWORD})
+                response.raise_for_status()
+                users.append({"username": username, "token": response.json()["access_token"], **fixtures[user_id]})
+
+            for name in args.scenarios:
+                # Logins are bcrypt-bound by design; a smaller sample says as much
+                requests = args.requests if name != "token" else max(args.requests // 10, args.concurrency)
+                report["scenarios"][name] = await run_scenario(
+                    client, name, users, requests, args.concurrency, seed=list(SCENARIOS).index(name),
+                )
+    return report
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Ratios against a baseline report: > 1 means this run is slower (latency) or faster (throughput)"""
+    ratios = {}
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        ratios[name] = {
+            "p50": round(current["p50_ms"] / max(previous["p50_ms"], 1e-6), 2),
+            "p95": round(current["p95_ms"] / max(previous["p95_ms"], 1e-6), 2),
+            "throughput": round(current["throughput_rps"] / max(previous["throughput_rps"], 1e-6), 2),
+            "queries_per_request": round(current["queries_per_request"] - previous["queries_per_request"], 2),
+        }
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="scratch database to use instead of a temporary SQLite file")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--identities", type=int, default=3, help="per user")
+    parser.add_argument("--skills", type=int, default=4, help="per identity")
+    parser.add_argument("--habits", type=int, default=3, help="per skill")
+    parser.add_argument("--tasks", type=int, default=100, help="per user")
+    parser.add_argument("--active-users", type=int, default=50, help="users that send requests")
+    parser.add_argument("--requests", type=int, default=500, help="per scenario; /token runs a tenth of this")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/api_load.db"
+    configure_environment(url)
+    sizes = seed_database(url, args)
+    report = asyncio.run(run(args, sizes))
+    report["config"] = {
+        key: getattr(args, key) for key in ("users", "active_users", "requests", "concurrency")
+    }
+    report["config"]["database_mode"] = os.environ.get("DATABASE_MODE", "async")
+    if args.compare:
+        with open(args.compare) as f:
+            report["compared_to_baseline"] = compare(report, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Query plans and latency for the hot filter paths, before and after the
+composite indexes from migration b7c4e1a9d2f3.
+
+    python -m benchmarks.index_plans --users 2000 --repeat 200 > index_plans.json
+
+Seeds a throwaway SQLite database (or --database-url for a scratch Postgres
+database, which is dropped and recreated) migrated to the revision before
+b7c4e1a9d2f3, runs every query shape, upgrades to b7c4e1a9d2f3, runs them
+again and prints JSON. Building both schemas from Alembic keeps indexes
+added by later migrations out of the comparison.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import MetaData, create_engine, insert, text
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+BEFORE_REVISION = "62e832763a1f"
+AFTER_REVISION = "b7c4e1a9d2f3"  # the composite foreign key indexes
+
+# The query shapes issued by the API, with the parameters each one needs
+QUERIES = {
+    "coach_pending_tasks": (
+        "SELECT title FROM tasks WHERE user_id = :user_id AND completed = false ORDER BY id DESC LIMIT 20",
+        ("user_id",),
+    ),
+    "coach_habits_by_streak": (
+        "SELECT name, streak FROM habits WHERE user_id = :user_id ORDER BY streak DESC LIMIT 10",
+        ("user_id",),
+    ),
+    "list_identities": ("SELECT * FROM identities WHERE user_id = :user_id", ("user_id",)),
+    "identity_ownership": (
+        "SELECT id FROM identities WHERE id = :identity_id AND user_id = :user_id",
+        ("identity_id", "user_id"),
+    ),
+    "list_skills": ("SELECT * FROM skills WHERE identity_id = :identity_id", ("identity_id",)),
+    "cascade_habits": (
+        "SELECT count(*) FROM habits WHERE skill_id IN (SELECT id FROM skills WHERE identity_id = :identity_id)",
+        ("identity_id",),
+    ),
+    "cascade_tasks": ("SELECT count(*) FROM tasks WHERE skill_id = :skill_id", ("skill_id",)),
+    "identity_tasks": ("SELECT count(*) FROM tasks WHERE identity_id = :identity_id", ("identity_id",)),
+}
+
+
+def seed(engine, users: int, identities: int, skills: int, habits: int, tasks: int, password_hash: str = "x",
+         reflect: bool = False):
+    """Insert the rows; with `reflect`, into the tables as they exist in the database rather than the models"""
+    from app import models
+
+    if reflect:
+        metadata = MetaData()
+        metadata.reflect(engine, only=("users", "identities", "skills", "habits", "tasks"))
+        tables = {name: metadata.tables[name] for name in ("users", "identities", "skills", "habits", "tasks")}
+    else:
+        tables = {model.__tablename__: model.__table__
+                  for model in (models.User, models.Identity, models.Skill, models.Habit, models.Task)}
+
+    now = datetime.utcnow()
+    rng = random.Random(42)
+    with engine.begin() as conn:
+        conn.execute(insert(tables["users"]), [
+            {"id": u, "username": f"user{u}", "email": f"user{u}@example.com", "hashed_password": password_hash}
+            for u in range(1, users + 1)
+        ])
+        identity_rows, skill_rows, habit_rows, task_rows = [], [], [], []
+        for u in range(1, users + 1):
+            for _ in range(identities):
+                identity_id = len(identity_rows) + 1
+                identity_rows.append({"id": identity_id, "user_id": u, "name": f"identity {identity_id}"})
+                for _ in range(skills):
+                    skill_id = len(skill_rows) + 1
+                    skill_rows.append({"id": skill_id, "identity_id": identity_id, "name": f"skill {skill_id}"})
+                    for _ in range(habits):
+                        habit_rows.append({
+                            "user_id": u, "skill_id": skill_id, "name": "habit",
+                            "streak": rng.randint(0, 60), "last_completed": now - timedelta(days=rng.randint(0, 5)),
+                        })
+            for t in range(tasks):
+                skill = rng.choice(skill_rows[-identities * skills:])
+                task_rows.append({
+                    "user_id": u, "skill_id": skill["id"], "identity_id": skill["identity_id"],
+                    "title": f"task {t}", "completed": rng.random() < 0.8,
+                })
+        for name, rows in (("identities", identity_rows), ("skills", skill_rows),
+                           ("habits", habit_rows), ("tasks", task_rows)):
+            for start in range(0, len(rows), 5000):
+                conn.execute(insert(tables[name]), rows[start:start + 5000])
+    return {"users": users, "identities": len(identity_rows), "skills": len(skill_rows),
+            "habits": len(habit_rows), "tasks": len(task_rows)}
+
+
+def explain(conn, sql: str, params: dict) -> list:
+    if conn.dialect.name == "sqlite":
+        return [row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql), params)]
+    return [row[0] for row in conn.execute(text("EXPLAIN " + sql), params)]
+
+
+def measure(engine, sizes: dict, repeat: int) -> dict:
+    rng = random.Random(7)
+    results = {}
+    with engine.connect() as conn:
+        for name, (sql, param_names) in QUERIES.items():
+            samples = []
+            plan = None
+            for _ in range(repeat):
+                params = {
+                    "user_id": rng.randint(1, sizes["users"]),
+                    "identity_id": rng.randint(1, sizes["identities"]),
+                    "skill_id": rng.randint(1, sizes["skills"]),
+                }
+                params = {k: params[k] for k in param_names}
+                if plan is None:
+                    plan = explain(conn, sql, params)
+                start = time.perf_counter()
+                conn.execute(text(sql), params).fetchall()
+                samples.append((time.perf_counter() - start) * 1000)
+            samples.sort()
+            results[name] = {
+                "plan": plan,
+                "mean_ms": round(statistics.fmean(samples), 4),
+                "p50_ms": round(samples[len(samples) // 2], 4),
+                "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 4),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="scratch database to use instead of a temporary SQLite file")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--identities", type=int, default=3, help="per user")
+    parser.add_argument("--skills", type=int, default=4, help="per identity")
+    parser.add_argument("--habits", type=int, default=3, help="per skill")
+    parser.add_argument("--tasks", type=int, default=200, help="per user")
+    parser.add_argument("--repeat", type=int, default=100, help="executions per query shape")
+    args = parser.parse_args()
+
+    url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/index_plans.db"
+    # alembic/env.py migrates settings.DATABASE_URL, so set it before `app` is imported
+    os.environ["DATABASE_URL"] = url
+    from alembic import command
+    from alembic.config import Config
+    from app import models
+
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option("script_location", str(ALEMBIC_INI.parent / "alembic"))
+    engine = create_engine(url)
+    models.Base.metadata.drop_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
+    command.upgrade(config, BEFORE_REVISION)
+
+    sizes = seed(engine, args.users, args.identities, args.skills, args.habits, args.tasks, reflect=True)
+    report = {"database": engine.dialect.name, "rows": sizes}
+
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    report["before"] = measure(engine, sizes, args.repeat)
+
+    command.upgrade(config, AFTER_REVISION)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    report["after"] = measure(engine, sizes, args.repeat)
+
+    report["speedup_p50"] = {
+        name: round(report["before"][name]["p50_ms"] / max(report["after"][name]["p50_ms"], 1e-6), 2)
+        for name in QUERIES
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+# Settings are read at import time, so this has to run before `app` is imported
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/test.db"
+os.environ["QUERY_BUDGET_MODE"] = "raise"
+os.environ["OPENAI_STUB"] = "true"
+os.environ["OPENAI_API_KEY"] = "sk-test"
+os.environ["SECRET_KEY"] = "test"
+os.environ["COACH_CACHE_BACKEND"] = "none"
+os.environ["POSITION_BUFFER_ENABLED"] = "false"
+os.environ["STREAK_MAINTENANCE_ENABLED"] = "false"
+
+import itertools
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+
+_usernames = (f"user{n}" for n in itertools.count())
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture(scope="session")
+def make_user(client):
+    """Returns a function that creates a user and returns its auth headers"""
+    def make() -> dict:
+        username = next(_usernames)
+        user = {"username": username, "email": f"{username}@example.com", "password": "pw"}
+        assert client.post("/users/", json=user).status_code == 200
+        token = client.post("/token", data={"username": username, "password": "pw"}).json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    return make
@@ -0,0 +1,106 @@
+"""Drive the budgeted routes with QUERY_BUDGET_MODE=raise.
+
+Any route that runs more statements than its @query_budget allows, or
+repeats one statement shape N_PLUS_ONE_THRESHOLD times, fails its test with
+QueryBudgetExceeded. The user gets more rows of each kind than the
+threshold, so a query-per-row regression shows up here. The environment is
+set up in conftest.py.
+
+    python -m pytest tests
+"""
+import pytest
+from app.config import settings
+from app.main import read_dashboard
+from app.query_budget import QueryBudgetExceeded
+
+ROWS = settings.N_PLUS_ONE_THRESHOLD + 1
+
+
+@pytest.fixture(scope="module")
+def headers(make_user):
+    return make_user()
+
+
+def create_tree(client, headers):
+    """ROWS identities and tasks, ROWS skills under the first identity and a habit per skill"""
+    tree = {"identities": [], "skills": [], "habits": [], "tasks": []}
+    for i in range(ROWS):
+        identity = client.post("/identities/", json={"name": f"I{i}"}, headers=headers).json()
+        parent = tree["identities"][0] if tree["identities"] else identity["id"]
+        skill = client.post("/skills/", json={"name": f"S{i}", "identity_id": parent}, headers=headers).json()
+        habit = client.post("/habits/", json={"name": f"H{i}", "skill_id": skill["id"]}, headers=headers).json()
+        task = client.post("/tasks/", json={
+            "title": f"T{i}", "identity_id": identity["id"], "skill_id": skill["id"], "exp_reward": 10,
+        }, headers=headers).json()
+        tree["identities"].append(identity["id"])
+        tree["skills"].append(skill["id"])
+        tree["habits"].append(habit["id"])
+        tree["tasks"].append(task["id"])
+    return tree
+
+
+@pytest.fixture(scope="module")
+def tree(client, headers):
+    return create_tree(client, headers)
+
+
+def test_dashboard(client, headers, tree):
+    response = client.get("/dashboard", headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()["identities"]) >= ROWS
+
+
+@pytest.mark.parametrize("path", ["/identities/", "/skills/?identity_id={identity}", "/habits/", "/tasks/"])
+def test_lists(client, headers, tree, path):
+    response = client.get(path.format(identity=tree["identities"][0]), headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()) >= ROWS
+
+
+def test_single_completions(client, headers, tree):
+    assert client.post(f"/habits/{tree['habits'][0]}/complete", headers=headers).status_code == 200
+    assert client.post(f"/tasks/{tree['tasks'][0]}/complete", headers=headers).status_code == 200
+
+
+def test_bulk_completions(client, headers, tree):
+    response = client.post("/habits/complete", json={"ids": tree["habits"]}, headers=headers)
+    assert response.status_code == 200
+    response = client.post(
+        "/tasks/complete", json={"ids": tree["tasks"]}, headers={**headers, "Idempotency-Key": "bulk"},
+    )
+    assert response.status_code == 200
+    assert len(response.json()) == ROWS
+
+
+def test_coach(client, headers, tree):
+    body = {"user_input": "What next?"}
+    assert client.post(f"/identities/{tree['identities'][0]}/ai-coach", json=body, headers=headers).status_code == 200
+    assert client.post(f"/skills/{tree['skills'][0]}/ai-coach", json=body, headers=headers).status_code == 200
+
+
+def test_items(client, headers, tree):
+    skill = f"skills:{tree['skills'][0]}"
+    assert client.patch(f"/items/{skill}/position", json={"x": 1, "y": 2}, headers=headers).status_code == 200
+    response = client.patch(f"/items/{skill}/section", json={"new_section": "skills", "position": 0}, headers=headers)
+    assert response.status_code == 200
+    refs = [f"{kind}:{item_id}" for kind in ("identities", "skills", "habits") for item_id in tree[kind]]
+    response = client.post("/items/batch", json={
+        "item_ids": refs, "updates": [{"x": n, "y": n} for n in range(len(refs))],
+    }, headers=headers)
+    assert response.status_code == 200
+    assert all(item["success"] for item in response.json())
+
+
+def test_cascade_deletes(client, headers):
+    tree = create_tree(client, headers)
+    for habit_id in tree["habits"]:
+        client.post(f"/habits/{habit_id}/complete", headers=headers)
+    assert client.delete(f"/skills/{tree['skills'][1]}", headers=headers).status_code == 200
+    # The first identity still owns ROWS - 1 skills, their habits and completions
+    assert client.delete(f"/identities/{tree['identities'][0]}", headers=headers).status_code == 200
+
+
+def test_over_budget_route_raises(client, headers, tree, monkeypatch):
+    monkeypatch.setattr(read_dashboard, "__query_budget__", 1)
+    with pytest.raises(QueryBudgetExceeded, match="budget 1"):
+        client.get("/dashboard", headers=headers)
@@ -0,0 +1,108 @@
+"""Completion rewards are applied exactly once.
+
+Each test reads exp, chrono_points and streaks back after completing, for a
+fresh user so the totals start at zero.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+EXP, CHRONO = 30, 2
+
+
+@pytest.fixture
+def headers(make_user):
+    return make_user()
+
+
+def create_task(client, headers) -> int:
+    response = client.post("/tasks/", json={"title": "T", "exp_reward": EXP, "chrono_reward": CHRONO}, headers=headers)
+    return response.json()["id"]
+
+
+def create_habit(client, headers) -> int:
+    response = client.post("/habits/", json={"name": "H", "exp_reward": EXP, "chrono_reward": CHRONO}, headers=headers)
+    return response.json()["id"]
+
+
+def totals(client, headers):
+    me = client.get("/users/me", headers=headers).json()
+    return me["exp"], me["chrono_points"]
+
+
+def streak(client, headers, habit_id: int) -> int:
+    habits = client.get("/habits/", headers=headers).json()
+    return next(habit["streak"] for habit in habits if habit["id"] == habit_id)
+
+
+def in_parallel(call, times: int = 8) -> list:
+    with ThreadPoolExecutor(max_workers=times) as pool:
+        return list(pool.map(lambda _: call(), range(times)))
+
+
+def test_repeated_task_completion_awards_once(client, headers):
+    task_id = create_task(client, headers)
+    for _ in range(3):
+        assert client.post(f"/tasks/{task_id}/complete", headers=headers).status_code == 200
+    assert totals(client, headers) == (EXP, CHRONO)
+
+
+def test_concurrent_task_completions_award_once(client, headers):
+    task_id = create_task(client, headers)
+    responses = in_parallel(lambda: client.post(f"/tasks/{task_id}/complete", headers=headers))
+    assert all(response.status_code == 200 for response in responses)
+    assert totals(client, headers) == (EXP, CHRONO)
+
+
+def test_idempotency_key_replays_stored_response(client, headers):
+    habit_id = create_habit(client, headers)
+    keyed = {**headers, "Idempotency-Key": "habit-once"}
+    first = client.post(f"/habits/{habit_id}/complete", headers=keyed)
+    replay = client.post(f"/habits/{habit_id}/complete", headers=keyed)
+    assert first.status_code == replay.status_code == 200
+    assert replay.json() == first.json() == {"status": "success", "streak": 1}
+    assert totals(client, headers) == (EXP, CHRONO)
+    assert streak(client, headers, habit_id) == 1
+
+    # A new key is a new completion
+    client.post(f"/habits/{habit_id}/complete", headers={**headers, "Idempotency-Key": "habit-twice"})
+    assert totals(client, headers) == (2 * EXP, 2 * CHRONO)
+    assert streak(client, headers, habit_id) == 2
+
+
+def test_concurrent_requests_with_one_key_apply_once(client, headers):
+    habit_id = create_habit(client, headers)
+    keyed = {**headers, "Idempotency-Key": "habit-race"}
+    responses = in_parallel(lambda: client.post(f"/habits/{habit_id}/complete", headers=keyed))
+    assert {response.status_code for response in responses} == {200}
+    assert all(response.json() == {"status": "success", "streak": 1} for response in responses)
+    assert totals(client, headers) == (EXP, CHRONO)
+    assert streak(client, headers, habit_id) == 1
+
+
+def test_bulk_replay_awards_once(client, headers):
+    task_ids = [create_task(client, headers) for _ in range(3)]
+    keyed = {**headers, "Idempotency-Key": "bulk-once"}
+    first = client.post("/tasks/complete", json={"ids": task_ids}, headers=keyed)
+    replay = client.post("/tasks/complete", json={"ids": task_ids}, headers=keyed)
+    assert replay.json() == first.json()
+    assert totals(client, headers) == (3 * EXP, 3 * CHRONO)
+
+
+def test_key_reused_for_another_request_is_rejected(client, headers):
+    task_id = create_task(client, headers)
+    habit_id = create_habit(client, headers)
+    keyed = {**headers, "Idempotency-Key": "reused"}
+    assert client.post(f"/tasks/{task_id}/complete", headers=keyed).status_code == 200
+
+    response = client.post(f"/habits/{habit_id}/complete", headers=keyed)
+    assert response.status_code == 422
+    assert totals(client, headers) == (EXP, CHRONO)
+    assert streak(client, headers, habit_id) == 0
+
+    # Same path, different body
+    other = create_task(client, headers)
+    response = client.post("/tasks/complete", json={"ids": [task_id]}, headers={**headers, "Idempotency-Key": "bulk"})
+    assert response.status_code == 200
+    response = client.post("/tasks/complete", json={"ids": [other]}, headers={**headers, "Idempotency-Key": "bulk"})
+    assert response.status_code == 422
+    assert totals(client, headers) == (EXP, CHRONO)